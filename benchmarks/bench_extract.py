@@ -0,0 +1,68 @@
+# Compare text extraction before and after mermaid_text on synthetic pages and markdown files.
+# "before" is what scrape_text and load_markdown_as_text used to do: BeautifulSoup's html.parser with
+# get_text(), and a markdown -> HTML -> BeautifulSoup round trip. It needs beautifulsoup4 and markdown installed.
+# "after" is html_to_text (lxml, and the standard library fallback) and markdown_to_text.
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import markdown
+from bs4 import BeautifulSoup
+
+import mermaid_text
+from corpus import document_lines, to_html, to_markdown
+from mermaid_chunking import count_tokens
+from mermaid_text import html_to_text, markdown_to_text
+
+MODEL_NAME = "gpt-4o-mini"
+
+def html_before(page_content):
+    return BeautifulSoup(page_content, "html.parser").get_text()
+
+def markdown_before(markdown_content):
+    return BeautifulSoup(markdown.markdown(markdown_content), "html.parser").get_text()
+
+# html_to_text with lxml hidden, as on machines where it is not installed
+def html_stdlib(page_content):
+    lxml, mermaid_text.lxml = mermaid_text.lxml, None
+    try:
+        return html_to_text(page_content)
+    finally:
+        mermaid_text.lxml = lxml
+
+# Median seconds per call over runs calls, and the last result
+def measure(function, argument, runs):
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function(argument)
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return durations[len(durations) // 2], result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark HTML and markdown text extraction before and after mermaid_text.")
+    parser.add_argument("--sizes", default="1,10,50", help="comma-separated document sizes in pages")
+    parser.add_argument("-n", "--runs", type=int, default=7)
+    args = parser.parse_args()
+    candidates = [("html", "before", html_before), ("html", "stdlib", html_stdlib), ("markdown", "before", markdown_before),
+                  ("markdown", "after", markdown_to_text)]
+    if mermaid_text.lxml is not None:
+        candidates.insert(2, ("html", "lxml", html_to_text))
+    print(f"{'format':<9} {'pages':>5} {'version':<7} {'ms':>9} {'speedup':>8} {'chars out':>10} {'tokens out':>11}")
+    for pages in (int(size) for size in args.sizes.split(",")):
+        lines = document_lines(pages)
+        documents = {"html": to_html(lines).encode("utf-8"), "markdown": to_markdown(lines)}
+        baseline = {}
+        for fmt, version, function in candidates:
+            seconds, text = measure(function, documents[fmt], args.runs)
+            baseline.setdefault(fmt, seconds)
+            print(f"{fmt:<9} {pages:>5} {version:<7} {seconds * 1000:>9.2f} {baseline[fmt] / seconds:>7.1f}x "
+                  f"{len(text):>10} {count_tokens(text, MODEL_NAME):>11}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,143 @@
+# Offline benchmark of the whole conversion pipeline over synthetic markdown, HTML and PDF documents.
+# Stages: extract (load_content), prompt (example selection and formatting), llm (a local fake model),
+# clean (clean_mermaid_code) and render (mermaid_chart_html). HTML pages are served from a local HTTP
+# server, so nothing leaves the machine. Latency is measured over --runs timed runs per stage; peak
+# memory comes from one more run under tracemalloc, which only sees this process (not PDF worker processes).
+import argparse
+import functools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import build_corpus
+from fake_llm import FakeChatModel
+from mermaid_pipeline import format_prompt, invoke_until_valid, load_content, prompt_template
+from mermaid_registry import get_example_index
+from mermaid_render import mermaid_chart_html
+from mermaid_selector import select_examples
+from mermaid_syntax import clean_mermaid_code
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mermaid_examples.py")
+MODEL_NAME = "gpt-4o-mini"
+
+
+class _CorpusHandler(SimpleHTTPRequestHandler):
+    # No Last-Modified header, so the fetch cache never short-circuits a request with a 304
+    def send_header(self, keyword, value):
+        if keyword != "Last-Modified":
+            super().send_header(keyword, value)
+
+    def log_message(self, format, *args):
+        pass
+
+# Serve directory on a free localhost port from a daemon thread
+def serve_directory(directory):
+    handler = functools.partial(_CorpusHandler, directory=directory)
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+# Nearest-rank percentile of an already sorted list
+def percentile(values, q):
+    index = max(0, min(len(values) - 1, round(q / 100 * len(values) + 0.5) - 1))
+    return values[index]
+
+def peak_memory(function):
+    tracemalloc.start()
+    try:
+        function()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+# Time function over runs calls (after one warm-up call) and return its last result with the stats
+def measure(function, runs, input_bytes, memory):
+    result = function()
+    durations = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        result = function()
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    mean = sum(durations) / len(durations)
+    stats = {
+        "runs": runs,
+        "p50_ms": percentile(durations, 50) * 1000,
+        "p99_ms": percentile(durations, 99) * 1000,
+        "throughput_kb_s": input_bytes / 1024 / mean if mean else float("inf"),
+        "peak_memory_mb": peak_memory(function) / 1024 / 1024 if memory else None,
+    }
+    return result, stats
+
+def run_document(source_type, source, pages, llm, runs, memory):
+    stats = {}
+    size = os.path.getsize(source) if source_type != "url" else None
+    text, stats["extract"] = measure(lambda: load_content(source, source_type), runs, size or 0, memory)
+    if source_type == "url":
+        stats["extract"]["throughput_kb_s"] = None
+    index = get_example_index(EXAMPLES_PATH)
+
+    def assemble():
+        examples, _ = select_examples(index, "mindmap", text, model_name=MODEL_NAME)
+        return format_prompt(prompt_template, examples, text, MODEL_NAME)
+
+    prompt, stats["prompt"] = measure(assemble, runs, len(text.encode("utf-8")), memory)
+    response, stats["llm"] = measure(lambda: invoke_until_valid(llm, prompt), runs, len(prompt.encode("utf-8")), memory)
+    code, stats["clean"] = measure(lambda: clean_mermaid_code(response), runs, len(response.encode("utf-8")), memory)
+    _, stats["render"] = measure(lambda: mermaid_chart_html(code), runs, len(code.encode("utf-8")), memory)
+    return [{"source_type": source_type, "pages": pages, "stage": stage, **values} for stage, values in stats.items()]
+
+def _format(value, digits):
+    return "-" if value is None else f"{value:.{digits}f}"
+
+def print_report(rows):
+    print(f"{'source':<9} {'pages':>5} {'stage':<8} {'p50 ms':>10} {'p99 ms':>10} {'KB/s':>12} {'peak MB':>9}")
+    for row in rows:
+        print(f"{row['source_type']:<9} {row['pages']:>5} {row['stage']:<8} {_format(row['p50_ms'], 3):>10} "
+              f"{_format(row['p99_ms'], 3):>10} {_format(row['throughput_kb_s'], 1):>12} {_format(row['peak_memory_mb'], 2):>9}")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the conversion pipeline offline with a fake LLM.")
+    parser.add_argument("--sizes", default="1,10,25", help="comma-separated document sizes in pages")
+    parser.add_argument("--sources", default="markdown,url,pdf", help="comma-separated source types to include")
+    parser.add_argument("-n", "--runs", type=int, default=5, help="timed runs per stage")
+    parser.add_argument("--diagram-nodes", type=int, default=200, help="nodes in the fake model's mindmap")
+    parser.add_argument("--llm-latency-ms", type=float, default=0.0, help="fake model latency per call")
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass")
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    sizes = [int(size) for size in args.sizes.split(",")]
+    sources = set(args.sources.split(","))
+    llm = FakeChatModel(nodes=args.diagram_nodes, latency=args.llm_latency_ms / 1000)
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        corpus = build_corpus(directory, sizes)
+        server = serve_directory(directory)
+        try:
+            for source_type, pages, path in corpus:
+                if source_type not in sources:
+                    continue
+                source = path
+                if source_type == "url":
+                    source = f"http://127.0.0.1:{server.server_port}/{os.path.basename(path)}"
+                rows.extend(run_document(source_type, source, pages, llm, args.runs, not args.no_memory))
+        finally:
+            server.shutdown()
+    print_report(rows)
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(rows, file, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+# Exercise model routing, retries and hedging against the fake OpenAI API in fake_openai_server.py.
+# For each policy (a fixed model, or "auto") it generates diagrams for a short and a long synthetic document
+# through the real ChatOpenAI client and reports success rate, latency and which models were called.
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import mermaid_routing
+from bench_pipeline import percentile
+from corpus import document_lines
+from fake_openai_server import FakeOpenAIConfig, base_url, start_server
+from mermaid_pipeline import generate_mermaid_code
+from mermaid_registry import get_llm
+from mermaid_tracing import trace
+
+EXAMPLES = ""
+
+
+def document(pages):
+    return "\n".join(text for _, text in document_lines(pages, seed=pages))
+
+# One generation under its own trace; returns (seconds, ok, models called, retries, hedged calls)
+def run_request(text, model_name):
+    with trace("routing-bench") as tracer:
+        start = time.perf_counter()
+        try:
+            generate_mermaid_code(text, EXAMPLES, "fake-key", model_name)
+            ok = True
+        except Exception:
+            ok = False
+        seconds = time.perf_counter() - start
+    calls = [s for s in tracer.spans if s.name == "llm.invoke"]
+    models = Counter(s.attributes["model"] for s in calls)
+    retries = sum(s.attributes.get("retries", 0) for s in calls)
+    hedged = sum(1 for s in calls if s.attributes.get("hedged"))
+    return seconds, ok, models, retries, hedged
+
+def run_policy(text, model_name, requests, concurrency):
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: run_request(text, model_name), range(requests)))
+    durations = sorted(seconds for seconds, *_ in results)
+    models = sum((result[2] for result in results), Counter())
+    return {
+        "requests": requests,
+        "success_rate": sum(1 for result in results if result[1]) / requests,
+        "p50_ms": percentile(durations, 50) * 1000,
+        "p99_ms": percentile(durations, 99) * 1000,
+        "calls": dict(models),
+        "retries": sum(result[3] for result in results),
+        "hedged": sum(result[4] for result in results),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark model routing against a fake OpenAI API")
+    parser.add_argument("--policies", default="gpt-4o-mini,gpt-4o,auto")
+    parser.add_argument("--short-pages", type=int, default=1)
+    parser.add_argument("--long-pages", type=int, default=20)
+    parser.add_argument("-n", "--requests", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--fast-latency", type=float, default=0.05, help="Seconds per gpt-4o-mini response")
+    parser.add_argument("--strong-latency", type=float, default=0.15, help="Seconds per gpt-4o response")
+    parser.add_argument("--fast-invalid-rate", type=float, default=0.2, help="Share of invalid gpt-4o-mini responses")
+    parser.add_argument("--tail-rate", type=float, default=0.05)
+    parser.add_argument("--tail-latency", type=float, default=1.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.05)
+    parser.add_argument("--server-error-rate", type=float, default=0.02)
+    parser.add_argument("--hedge", default="auto", help='Hedge delay in seconds, "auto" (p95 of recent calls) or "off"')
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+    # Invalid responses and retries are expected here; only the summary is of interest
+    logging.basicConfig(level=logging.ERROR)
+
+    config = FakeOpenAIConfig(
+        latency={mermaid_routing.FAST_MODEL: args.fast_latency, mermaid_routing.STRONG_MODEL: args.strong_latency},
+        invalid_rate={mermaid_routing.FAST_MODEL: args.fast_invalid_rate},
+        tail_rate=args.tail_rate, tail_latency=args.tail_latency,
+        rate_limit_rate=args.rate_limit_rate, server_error_rate=args.server_error_rate, retry_after=0.05,
+    )
+    server = start_server(config)
+    os.environ["OPENAI_API_BASE"] = base_url(server)
+    get_llm.cache_clear()
+    mermaid_routing.HEDGE_AFTER_SECONDS = args.hedge
+
+    results = {}
+    for label, pages in (("short", args.short_pages), ("long", args.long_pages)):
+        text = document(pages)
+        for model_name in args.policies.split(","):
+            stats = run_policy(text, model_name, args.requests, args.concurrency)
+            results[f"{label} {model_name}"] = stats
+            print(f"{label:>5} {model_name:<12} ok {stats['success_rate']:6.1%}  p50 {stats['p50_ms']:7.1f} ms  "
+                  f"p99 {stats['p99_ms']:7.1f} ms  retries {stats['retries']:3d}  hedged {stats['hedged']:3d}  "
+                  f"calls {stats['calls']}")
+    print("server:", dict(sorted(config.counts.items())))
+    server.shutdown()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump({"results": results, "server": dict(config.counts)}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Micro-benchmark of the per-request setup done before every LLM call:
+# loading the examples, building the prompt template and the LLM client, and picking examples.
+# "before" repeats that work on every request, as the app used to; "after" goes through mermaid_registry.
+import argparse
+import importlib.util
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from langchain_openai import ChatOpenAI
+from langchain.prompts import PromptTemplate
+
+from mermaid_pipeline import prompt_template
+from mermaid_registry import get_example_index, get_llm, get_prompt
+from mermaid_selector import ExampleIndex, select_examples
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "mermaid_examples.py")
+API_KEY = "sk-benchmark"
+MODEL_NAME = "gpt-4o-mini"
+
+def setup_before():
+    spec = importlib.util.spec_from_file_location("mermaid_examples", EXAMPLES_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    examples, _ = select_examples(ExampleIndex(module.mermaid_examples), "mindmap", model_name=MODEL_NAME)
+    llm = ChatOpenAI(api_key=API_KEY, model_name=MODEL_NAME)
+    prompt = PromptTemplate.from_template(template=prompt_template)
+    return llm, prompt.format(examples=examples, text="")
+
+def setup_after():
+    examples, _ = select_examples(get_example_index(EXAMPLES_PATH), "mindmap", model_name=MODEL_NAME)
+    llm = get_llm(API_KEY, MODEL_NAME)
+    prompt = get_prompt(prompt_template)
+    return llm, prompt.format(examples=examples, text="")
+
+def measure(setup, iterations):
+    setup()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        setup()
+    return (time.perf_counter() - start) / iterations
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare per-request setup time with and without mermaid_registry.")
+    parser.add_argument("-n", "--iterations", type=int, default=200)
+    args = parser.parse_args()
+    before = measure(setup_before, args.iterations)
+    after = measure(setup_after, args.iterations)
+    print(f"before: {before * 1000:8.3f} ms per request")
+    print(f"after:  {after * 1000:8.3f} ms per request")
+    print(f"speedup: {before / after:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+# Deterministic synthetic documents for the benchmarks: markdown, HTML and PDF files of a given size.
+# Sizes are in pages of roughly PAGE_LINES lines of text, so the three formats carry comparable content.
+# PDFs are written by hand with the standard Helvetica font, so no PDF library is needed to build them.
+import os
+import random
+
+PAGE_LINES = 50
+LINE_WORDS = 14
+IMAGE_WIDTH = 1024
+
+WORDS = (
+    "system data model process network service layer cache request response latency throughput "
+    "storage memory index query schema table record event stream queue worker batch pipeline stage "
+    "input output format parser token diagram node edge graph section chapter summary analysis result "
+    "method design review metric budget policy access control security audit report release version"
+).split()
+
+
+def _sentence(rng):
+    words = [rng.choice(WORDS) for _ in range(LINE_WORDS)]
+    return " ".join(words).capitalize() + "."
+
+# Lines of one document: a heading every few paragraphs, PAGE_LINES lines per page
+def document_lines(pages, seed=0):
+    rng = random.Random(seed)
+    lines = []
+    for page in range(pages):
+        for line in range(PAGE_LINES):
+            if line % 10 == 0:
+                lines.append(("heading", f"Section {page + 1}.{line // 10 + 1}: {rng.choice(WORDS).title()} {rng.choice(WORDS)}"))
+            else:
+                lines.append(("text", _sentence(rng)))
+    return lines
+
+# Markdown with the usual inline markup: emphasis, links and list items
+def to_markdown(lines):
+    parts = []
+    for number, (kind, text) in enumerate(lines):
+        if kind == "heading":
+            parts.append(f"\n## {text}\n")
+        elif number % 5 == 0:
+            first, rest = text.split(" ", 1)
+            parts.append(f"- **{first}** {rest} See [the docs](https://example.com/docs/{number}).")
+        else:
+            parts.append(text)
+    return "\n".join(parts) + "\n"
+
+# A page with the chrome real sites carry around the article: inline scripts and styles, menus, sidebar and footer
+def to_html(lines):
+    menu = "".join(f"<li><a href='/{word}'>{word.title()}</a></li>" for word in WORDS)
+    script = "window.analytics = window.analytics || [];\n" + "analytics.push({event: 'view', id: 42});\n" * 300
+    parts = ["<!DOCTYPE html>", "<html><head><meta charset='utf-8'><title>Benchmark document</title>",
+             "<style>" + "body { font-family: sans-serif; } .nav li { display: inline; }\n" * 100 + "</style>",
+             f"<script>{script}</script></head><body>",
+             f"<header><a href='/'>Logo</a><nav><ul class='nav'>{menu}</ul></nav></header>", "<main><article>"]
+    for kind, text in lines:
+        parts.append(f"<h2>{text}</h2>" if kind == "heading" else f"<p>{text}</p>")
+    parts += ["</article></main>", f"<aside><h3>Related</h3><ul>{menu}</ul></aside>",
+              "<form class='cookie-banner'><p>We use cookies.</p><button>Accept</button></form>",
+              f"<footer><ul>{menu}</ul><p>Copyright</p></footer>", "</body></html>"]
+    return "\n".join(parts)
+
+def _pdf_escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+# A minimal PDF with one text page per PAGE_LINES lines. With image_bytes, every page also shows an
+# uncompressed greyscale image of about that size, like a scanned or illustrated document.
+def to_pdf(lines, image_bytes=0):
+    pages = [lines[i:i + PAGE_LINES] for i in range(0, len(lines), PAGE_LINES)]
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_ids = []
+    for number, page in enumerate(pages):
+        stream = ["BT", "/F1 8 Tf", "10 TL", "40 800 Td"]
+        stream += [f"({_pdf_escape(text)}) '" for _, text in page]
+        stream.append("ET")
+        resources = "/Font << /F1 3 0 R >>"
+        if image_bytes:
+            height = max(1, image_bytes // IMAGE_WIDTH)
+            pixels = bytes((number + i) % 256 for i in range(IMAGE_WIDTH)) * height
+            objects.append(f"<< /Type /XObject /Subtype /Image /Width {IMAGE_WIDTH} /Height {height} "
+                           f"/ColorSpace /DeviceGray /BitsPerComponent 8 /Length {len(pixels)} >>\nstream\n".encode("latin-1")
+                           + pixels + b"\nendstream")
+            resources += f" /XObject << /Im1 {len(objects)} 0 R >>"
+            stream += ["q", "300 0 0 200 250 40 cm", "/Im1 Do", "Q"]
+        content = "\n".join(stream).encode("latin-1")
+        objects.append(f"<< /Length {len(content)} >>\nstream\n".encode("latin-1") + content + b"\nendstream")
+        content_id = len(objects)
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] /Contents {content_id} 0 R "
+                       f"/Resources << {resources} >> >>")
+        page_ids.append(len(objects))
+    kids = " ".join(f"{page_id} 0 R" for page_id in page_ids)
+    objects[1] = f"<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>"
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        body = body if isinstance(body, bytes) else body.encode("latin-1")
+        output += f"{number} 0 obj\n".encode("latin-1") + body + b"\nendobj\n"
+    xref_offset = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode("latin-1")
+    output += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode("latin-1")
+    output += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref_offset}\n%%EOF\n".encode("latin-1")
+    return bytes(output)
+
+# Write one document of each format per size into directory; returns [(source_type, pages, path)]
+def build_corpus(directory, sizes, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    corpus = []
+    for pages in sizes:
+        lines = document_lines(pages, seed + pages)
+        for source_type, extension, data in (
+            ("markdown", "md", to_markdown(lines).encode("utf-8")),
+            ("url", "html", to_html(lines).encode("utf-8")),
+            ("pdf", "pdf", to_pdf(lines)),
+        ):
+            path = os.path.join(directory, f"doc-{pages}p.{extension}")
+            with open(path, "wb") as file:
+                file.write(data)
+            corpus.append((source_type, pages, path))
+    return corpus
@@ -0,0 +1,59 @@
+# Deterministic local stand-in for ChatOpenAI, so the pipeline can be benchmarked with no network or API key.
+# It answers every prompt with the same canned mindmap of a configurable size after a configurable delay.
+import asyncio
+import time
+
+from langchain_core.messages import AIMessage, AIMessageChunk
+
+# A mindmap with the given number of nodes, three children per branch, laid out breadth-first
+def canned_mindmap(nodes=50, seed_label="Topic"):
+    lines = ["```mermaid", "mindmap", '    root(("Benchmark document"))']
+    # (indent, label) of nodes still waiting for children
+    frontier = [(2, "")]
+    produced = 0
+    while produced < nodes:
+        indent, parent_label = frontier.pop(0)
+        for child in range(1, 4):
+            if produced == nodes:
+                break
+            label = f"{parent_label}.{child}" if parent_label else str(child)
+            lines.append("    " * indent + f'("{seed_label} {label}: data, model & latency")')
+            frontier.append((indent + 1, label))
+            produced += 1
+    lines.append("```")
+    return "\n".join(lines) + "\n"
+
+
+class FakeChatModel:
+    # Mimics the parts of ChatOpenAI the pipeline uses: invoke, ainvoke and stream
+    def __init__(self, nodes=50, latency=0.0, stream_chunk_characters=16, model_name="fake-benchmark-model"):
+        self.model_name = model_name
+        self.latency = latency
+        self.stream_chunk_characters = stream_chunk_characters
+        self.response = canned_mindmap(nodes)
+        self.calls = 0
+
+    def _message(self, prompt):
+        self.calls += 1
+        # Rough token counts so usage shows up in traces like a real response
+        usage = {
+            "input_tokens": len(prompt) // 4,
+            "output_tokens": len(self.response) // 4,
+            "total_tokens": (len(prompt) + len(self.response)) // 4,
+        }
+        return AIMessage(content=self.response, usage_metadata=usage)
+
+    def invoke(self, prompt):
+        time.sleep(self.latency)
+        return self._message(prompt)
+
+    async def ainvoke(self, prompt):
+        await asyncio.sleep(self.latency)
+        return self._message(prompt)
+
+    def stream(self, prompt):
+        self.calls += 1
+        time.sleep(self.latency)
+        size = self.stream_chunk_characters
+        for start in range(0, len(self.response), size):
+            yield AIMessageChunk(content=self.response[start:start + size])
@@ -0,0 +1,182 @@
+# Local stand-in for the OpenAI chat completions API, for exercising model routing, retries and hedging.
+# Every model answers with the canned benchmark mindmap after its own latency; a share of requests can be
+# slow (the tail), fail with 429 or 500, or come back as invalid Mermaid code. Point the app at it with
+#
+#   python benchmarks/fake_openai_server.py --port 8765 --latency gpt-4o-mini=0.3 --invalid-rate gpt-4o-mini=0.2
+#   OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=fake streamlit run streamlit_app.py
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from fake_llm import canned_mindmap
+
+# Two root nodes, which clean_mermaid_code rejects
+INVALID_MINDMAP = '```mermaid\nmindmap\n    root(("Benchmark document"))\n    other(("Second root"))\n```\n'
+STREAM_CHUNK_CHARACTERS = 16
+
+
+class FakeOpenAIConfig:
+    # Per-model settings are dicts of model name to value; "*" applies to models not listed
+    def __init__(self, latency=None, invalid_rate=None, tail_rate=0.0, tail_latency=0.0,
+                 rate_limit_rate=0.0, server_error_rate=0.0, retry_after=0.1, nodes=50, seed=0):
+        self.latency = latency or {}
+        self.invalid_rate = invalid_rate or {}
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.retry_after = retry_after
+        self.response = canned_mindmap(nodes)
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        # Counters per "model outcome", e.g. "gpt-4o-mini ok", "gpt-4o 429"
+        self.counts = Counter()
+
+    def setting(self, values, model):
+        return values.get(model, values.get("*", 0.0))
+
+    def draw(self):
+        with self.lock:
+            return self.random.random()
+
+    def count(self, model, outcome):
+        with self.lock:
+            self.counts[f"{model} {outcome}"] += 1
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=()):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for keyword, value in headers:
+            self.send_header(keyword, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, model, status, error_type, headers=()):
+        self.server.config.count(model, status)
+        self._send_json(status, {"error": {"message": f"Fake {status} from {model}", "type": error_type}}, headers)
+
+    def do_POST(self):
+        if not self.path.endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "type": "invalid_request_error"}})
+            return
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        config = self.server.config
+        model = request.get("model", "")
+        delay = config.setting(config.latency, model)
+        if config.draw() < config.tail_rate:
+            delay += config.tail_latency
+        time.sleep(delay)
+
+        draw = config.draw()
+        if draw < config.rate_limit_rate:
+            self._send_error(model, 429, "rate_limit_error", [("Retry-After", str(config.retry_after))])
+            return
+        if draw < config.rate_limit_rate + config.server_error_rate:
+            self._send_error(model, 500, "server_error")
+            return
+        invalid = config.draw() < config.setting(config.invalid_rate, model)
+        config.count(model, "invalid" if invalid else "ok")
+        content = INVALID_MINDMAP if invalid else config.response
+        prompt_characters = sum(len(str(message.get("content", ""))) for message in request.get("messages", []))
+        usage = {
+            "prompt_tokens": prompt_characters // 4,
+            "completion_tokens": len(content) // 4,
+            "total_tokens": (prompt_characters + len(content)) // 4,
+        }
+        if request.get("stream"):
+            self._stream(model, content, usage)
+        else:
+            self._send_json(200, {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            })
+
+    # Server-sent events, one chunk of content per event, as the streaming API sends them
+    def _stream(self, model, content, usage):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        pieces = [content[i:i + STREAM_CHUNK_CHARACTERS] for i in range(0, len(content), STREAM_CHUNK_CHARACTERS)]
+        events = [({"role": "assistant", "content": piece}, None) for piece in pieces] + [({}, "stop")]
+        for delta, finish_reason in events:
+            chunk = {
+                "id": "chatcmpl-fake",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if finish_reason:
+                chunk["usage"] = usage
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+# Serve the fake API on port (0 for any free port) from a daemon thread; the base URL is http://host:port/v1
+def start_server(config, host="127.0.0.1", port=0):
+    server = ThreadingHTTPServer((host, port), _Handler)
+    server.daemon_threads = True
+    server.config = config
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def base_url(server):
+    host, port = server.server_address[:2]
+    return f"http://{host}:{port}/v1"
+
+# Parse repeated "model=value" options into a dict; a bare value applies to every model
+def _per_model(values):
+    settings = {}
+    for value in values or ():
+        model, _, number = value.rpartition("=")
+        settings[model or "*"] = float(number)
+    return settings
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake OpenAI chat completions API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", action="append", help="Seconds per response, as model=seconds or seconds")
+    parser.add_argument("--invalid-rate", action="append", help="Share of invalid Mermaid responses, as model=share or share")
+    parser.add_argument("--tail-rate", type=float, default=0.0, help="Share of requests that take --tail-latency longer")
+    parser.add_argument("--tail-latency", type=float, default=0.0)
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of requests answered with 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="Share of requests answered with 500")
+    parser.add_argument("--nodes", type=int, default=50, help="Nodes in the canned mindmap")
+    args = parser.parse_args()
+
+    config = FakeOpenAIConfig(
+        latency=_per_model(args.latency), invalid_rate=_per_model(args.invalid_rate),
+        tail_rate=args.tail_rate, tail_latency=args.tail_latency, rate_limit_rate=args.rate_limit_rate,
+        server_error_rate=args.server_error_rate, nodes=args.nodes,
+    )
+    server = start_server(config, args.host, args.port)
+    print(f"Fake OpenAI API at {base_url(server)}; press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        print(json.dumps(dict(config.counts), indent=2, sort_keys=True))
+
+
+if __name__ == "__main__":
+    main()
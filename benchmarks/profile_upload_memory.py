@@ -0,0 +1,150 @@
+# Memory profile of several large PDF uploads converted at once, comparing:
+#   in-memory  the upload is handed to extraction as a file object, as Streamlit's UploadedFile was:
+#              its bytes are copied out and pickled to every worker process
+#   spooled    the upload is spooled to disk, memory-mapped, and extraction waits for the memory budget
+#   bounded    spooled, with MERMAID_PDF_MEMORY_MB set so that only one extraction fits at a time
+# Every scenario runs in a fresh process. A sampler reads the proportional anonymous (non-reclaimable) memory of
+# that process and its children from /proc, so this script needs Linux. The upload itself stays in memory in
+# every scenario, as Streamlit keeps it for as long as the file uploader shows it.
+import argparse
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from corpus import document_lines, to_pdf
+
+SAMPLE_SECONDS = 0.02
+SCENARIOS = ("in-memory", "spooled", "bounded")
+
+
+# Proportional anonymous memory: pages shared between processes are split between them rather than counted in each
+def _anonymous_bytes(pid):
+    try:
+        with open(f"/proc/{pid}/smaps_rollup", encoding="ascii") as file:
+            for line in file:
+                if line.startswith("Pss_Anon:"):
+                    return int(line.split()[1]) * 1024
+    except (FileNotFoundError, ProcessLookupError):
+        pass
+    return 0
+
+def _descendants(pid):
+    children = []
+    try:
+        for task in os.listdir(f"/proc/{pid}/task"):
+            with open(f"/proc/{pid}/task/{task}/children", encoding="ascii") as file:
+                children += [int(child) for child in file.read().split()]
+    except FileNotFoundError:
+        return []
+    return children + [grandchild for child in children for grandchild in _descendants(child)]
+
+
+class MemorySampler:
+    # Peak anonymous memory of this process and all of its descendants, summed at each sample
+    def __init__(self):
+        self.peak = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        pid = os.getpid()
+        while not self._stop.is_set():
+            total = sum(_anonymous_bytes(p) for p in [pid] + _descendants(pid))
+            self.peak = max(self.peak, total)
+            time.sleep(SAMPLE_SECONDS)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+
+
+# One conversion's extraction, the way the scenario handles uploads
+def _extract(scenario, upload, size, workers):
+    from mermaid_pdf import extract_pdf_pages, pdf_page_count
+    from mermaid_uploads import get_pdf_memory_budget, pdf_extraction_plan, remove_upload, spool_upload
+
+    if scenario == "in-memory":
+        return extract_pdf_pages(upload, max_workers=workers)
+    path = spool_upload(upload, "upload.pdf")
+    try:
+        workers, reserved = pdf_extraction_plan(size, pdf_page_count(path), workers)
+        with get_pdf_memory_budget().reserve(reserved):
+            return extract_pdf_pages(path, max_workers=workers)
+    finally:
+        remove_upload(path)
+
+# Run one scenario in this process and print its measurements as JSON
+def run_child(args):
+    os.chdir(tempfile.mkdtemp())
+    with open(args.pdf, "rb") as file:
+        data = file.read()
+    uploads = [io.BytesIO(data) for _ in range(args.uploads)]
+    del data
+    # Measured on top of the uploads themselves
+    baseline = _anonymous_bytes(os.getpid())
+    start = time.perf_counter()
+    with MemorySampler() as sampler:
+        threads = [
+            threading.Thread(target=_extract, args=(args.scenario, upload, os.path.getsize(args.pdf), args.workers))
+            for upload in uploads
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    print(json.dumps({
+        "scenario": args.scenario,
+        "seconds": time.perf_counter() - start,
+        "peak_mb": (sampler.peak - baseline) / 1024 / 1024,
+    }))
+
+def main():
+    parser = argparse.ArgumentParser(description="Profile memory while several large PDF uploads are extracted at once")
+    parser.add_argument("--pages", type=int, default=40)
+    parser.add_argument("--image-kb", type=int, default=2048, help="Size of the image on every page")
+    parser.add_argument("--uploads", type=int, default=3, help="Uploads extracted at the same time")
+    parser.add_argument("--workers", type=int, default=4, help="Extraction processes per upload, at most")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--pdf", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.scenario:
+        run_child(args)
+        return
+
+    directory = tempfile.mkdtemp()
+    pdf_path = os.path.join(directory, "large.pdf")
+    with open(pdf_path, "wb") as file:
+        file.write(to_pdf(document_lines(args.pages), image_bytes=args.image_kb * 1024))
+    size_mb = os.path.getsize(pdf_path) / 1024 / 1024
+    print(f"{args.uploads} concurrent uploads of a {size_mb:.0f} MB, {args.pages}-page PDF, up to {args.workers} processes each")
+
+    from mermaid_uploads import pdf_memory_estimate
+    # Room for a single extraction process, so bounded extractions run one after another
+    single_mb = pdf_memory_estimate(os.path.getsize(pdf_path)) // 1024 // 1024 + 1
+    for scenario in args.scenarios.split(","):
+        env = dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path))
+        if scenario == "bounded":
+            env["MERMAID_PDF_MEMORY_MB"] = str(single_mb)
+        command = [sys.executable, os.path.abspath(__file__), "--scenario", scenario, "--pdf", pdf_path,
+                   "--uploads", str(args.uploads), "--workers", str(args.workers)]
+        output = subprocess.run(command, env=env, check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        print(f"{scenario:>10}  peak {result['peak_mb']:8.1f} MB  ({result['peak_mb'] / size_mb:5.1f}x file size)  "
+              f"{result['seconds']:6.1f} s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from mermaid_compaction import compact_text
+from mermaid_incremental import aregenerate_incremental
+from mermaid_pdf import PROCESS_CONTEXT, extract_pdf_pages
+from mermaid_pipeline import agenerate_mermaid_code_chunked, clean_mermaid_code, fetch_text, load_content
+from mermaid_registry import get_example_index
+from mermaid_render import RENDER_FORMATS, render_diagram
+from mermaid_selector import select_examples
+from mermaid_tracing import trace
+
+logger = logging.getLogger(__name__)
+
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mermaid_examples.py")
+
+
+class RateLimiter:
+    # Async context manager capping both in-flight LLM calls and how often new calls may start
+    def __init__(self, max_concurrency, requests_per_minute=None):
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._interval = 60.0 / requests_per_minute if requests_per_minute else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+
+    async def __aenter__(self):
+        await self._semaphore.acquire()
+        try:
+            if self._interval:
+                async with self._lock:
+                    now = time.monotonic()
+                    wait = self._next_start - now
+                    self._next_start = max(now, self._next_start) + self._interval
+                if wait > 0:
+                    await asyncio.sleep(wait)
+        except BaseException:
+            # Cancelled while spacing out starts, e.g. a hedge request that lost: __aexit__ will not run
+            self._semaphore.release()
+            raise
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self._semaphore.release()
+
+
+# Work out the source type from a manifest entry the same way load_content names them
+def infer_source_type(source):
+    if re.match(r"https?://", source):
+        return "url"
+    extension = os.path.splitext(source)[1].lower()
+    if extension == ".pdf":
+        return "pdf"
+    if extension in (".md", ".markdown"):
+        return "markdown"
+    raise ValueError(f"Cannot infer the source type of {source!r}, set \"type\" in the manifest")
+
+# Read a manifest: a JSON list of sources or {"source", "type", "name"} objects, or one source per line
+def load_manifest(path):
+    with open(path, "r", encoding="utf-8") as file:
+        content = file.read()
+    if path.endswith(".json"):
+        entries = json.loads(content)
+    else:
+        entries = [line.strip() for line in content.splitlines() if line.strip() and not line.lstrip().startswith("#")]
+    manifest = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"source": entry}
+        entry.setdefault("type", infer_source_type(entry["source"]))
+        manifest.append(entry)
+    return manifest
+
+# Build a unique, filesystem-safe output name for every entry
+def output_names(manifest):
+    names, seen = [], {}
+    for entry in manifest:
+        stem = entry.get("name")
+        if not stem:
+            if entry["type"] == "url":
+                stem = re.sub(r"^https?://", "", entry["source"])
+            else:
+                stem = os.path.splitext(os.path.basename(entry["source"]))[0]
+        stem = re.sub(r"[^A-Za-z0-9._-]+", "_", stem).strip("._") or "diagram"
+        count = seen.get(stem, 0)
+        seen[stem] = count + 1
+        names.append(stem if count == 0 else f"{stem}_{count}")
+    return names
+
+# Worker: extract the text of one entry as a list of pages, timing it; runs in a separate process
+def extract_entry(entry):
+    start = time.perf_counter()
+    if entry["type"] == "pdf":
+        # The batch pool already spreads documents over the cores, so each PDF stays single-process
+        pages = extract_pdf_pages(entry["source"], include_tables=entry.get("include_tables", False), max_workers=1)
+    elif entry["type"] == "url":
+        # A page that cannot be fetched is a failed entry, not a diagram of an error message
+        pages = [fetch_text(entry["source"])]
+    else:
+        pages = [load_content(entry["source"], entry["type"])]
+    return pages, time.perf_counter() - start
+
+# Extract, generate and write one entry, returning its summary record
+async def convert_entry(entry, name, args, example_index, executor, limiter):
+    record = {"source": entry["source"], "type": entry["type"], "output": None, "status": "ok", "error": None}
+    start = time.perf_counter()
+    with trace("conversion", source=entry["source"], source_type=entry["type"], model=args.model) as tracer:
+        try:
+            loop = asyncio.get_running_loop()
+            pages, record["extract_seconds"] = await loop.run_in_executor(executor, extract_entry, entry)
+            # CPU-bound steps run on worker threads so they do not stall the other entries' LLM calls
+            if args.compact:
+                text, record["compaction"] = await asyncio.to_thread(compact_text, pages, args.model, args.token_budget)
+            else:
+                text = "\n".join(pages)
+            del pages
+            record["characters"] = len(text)
+            generate_start = time.perf_counter()
+            selected_examples, record["examples"] = await asyncio.to_thread(
+                select_examples, example_index, "mindmap", text, model_name=args.model
+            )
+            if args.incremental:
+                mermaid_code, record["incremental"] = await aregenerate_incremental(
+                    text, entry["source"], selected_examples, args.api_key, args.model, limiter=limiter
+                )
+            else:
+                mermaid_code = await agenerate_mermaid_code_chunked(text, selected_examples, args.api_key, args.model, limiter=limiter)
+            record["generate_seconds"] = time.perf_counter() - generate_start
+            output_path = os.path.join(args.output_dir, f"{name}.mmd")
+            cleaned_mermaid_code = await asyncio.to_thread(clean_mermaid_code, mermaid_code)
+            with open(output_path, "w", encoding="utf-8") as file:
+                file.write(cleaned_mermaid_code + "\n")
+            record["output"] = output_path
+            for fmt in args.render:
+                # mmdc is a subprocess, so rendering on a worker thread keeps other entries moving
+                data = await asyncio.to_thread(render_diagram, cleaned_mermaid_code, fmt)
+                render_path = os.path.join(args.output_dir, f"{name}.{fmt}")
+                with open(render_path, "wb") as file:
+                    file.write(data)
+                record.setdefault("renders", []).append(render_path)
+        except Exception as e:
+            logger.exception("Failed to convert %s", entry["source"])
+            record["status"] = "error"
+            record["error"] = f"{type(e).__name__}: {e}"
+    record["total_seconds"] = time.perf_counter() - start
+    record["spans"] = tracer.summary()
+    logger.info("%s %s in %.2fs", record["status"], entry["source"], record["total_seconds"])
+    return record
+
+async def run_batch(args):
+    manifest = load_manifest(args.manifest)
+    os.makedirs(args.output_dir, exist_ok=True)
+    example_index = get_example_index(EXAMPLES_PATH)
+    limiter = RateLimiter(args.max_concurrency, args.requests_per_minute)
+    start = time.perf_counter()
+    records = [None] * len(manifest)
+    entries = iter(enumerate(zip(manifest, output_names(manifest))))
+
+    # Only max_entries documents are in progress at a time, so the text of the rest is not held while they wait
+    async def convert_entries(executor):
+        for i, (entry, name) in entries:
+            records[i] = await convert_entry(entry, name, args, example_index, executor, limiter)
+
+    with ProcessPoolExecutor(max_workers=args.extract_workers, mp_context=PROCESS_CONTEXT) as executor:
+        await asyncio.gather(*(convert_entries(executor) for _ in range(min(args.max_entries, len(manifest)))))
+    summary = {
+        "model": args.model,
+        "total": len(records),
+        "succeeded": sum(record["status"] == "ok" for record in records),
+        "failed": sum(record["status"] != "ok" for record in records),
+        "wall_seconds": time.perf_counter() - start,
+        "results": records,
+    }
+    with open(os.path.join(args.output_dir, "summary.json"), "w", encoding="utf-8") as file:
+        json.dump(summary, file, indent=2)
+    return summary
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Convert many URLs, PDFs and markdown files into Mermaid mindmaps.")
+    parser.add_argument("manifest", help="JSON list of sources or {source, type, name} objects, or a text file with one source per line")
+    parser.add_argument("-o", "--output-dir", default="mermaid_output", help="directory for the .mmd files and summary.json")
+    parser.add_argument("--model", default="auto", help='OpenAI model name, or "auto" to route by input length')
+    parser.add_argument("--api-key", default=os.environ.get("OPENAI_API_KEY"), help="OpenAI API key (default: $OPENAI_API_KEY)")
+    parser.add_argument("--extract-workers", type=int, default=os.cpu_count(), help="processes used for text extraction")
+    parser.add_argument("--max-concurrency", type=int, default=8, help="maximum LLM calls in flight")
+    parser.add_argument("--max-entries", type=int, default=16, help="maximum documents being converted at once")
+    parser.add_argument("--requests-per-minute", type=float, default=None, help="maximum LLM calls started per minute")
+    parser.add_argument("--no-compact", dest="compact", action="store_false", help="send the extracted text as is, without removing page furniture and duplicates")
+    parser.add_argument("--token-budget", type=int, default=None, help="compress each document extractively to at most this many tokens")
+    parser.add_argument("--incremental", action="store_true", help="regenerate only the sections that changed since the last run over the same source")
+    parser.add_argument("--render", action="append", default=[], choices=RENDER_FORMATS, help="also render each diagram to this format with the Mermaid CLI (repeatable)")
+    args = parser.parse_args(argv)
+    if not args.api_key:
+        parser.error("an OpenAI API key is required, pass --api-key or set OPENAI_API_KEY")
+    return args
+
+def main(argv=None):
+    logging.basicConfig(level=logging.INFO)
+    summary = asyncio.run(run_batch(parse_args(argv)))
+    print(f"{summary['succeeded']}/{summary['total']} converted in {summary['wall_seconds']:.1f}s")
+    return 0 if summary["failed"] == 0 else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,105 @@
+import contextlib
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+# Default location and limits for the on-disk result cache
+DEFAULT_CACHE_PATH = os.path.join(".mermaid_cache", "results.sqlite3")
+DEFAULT_MAX_BYTES = 50 * 1024 * 1024
+DEFAULT_TTL_SECONDS = 7 * 24 * 60 * 60
+
+# Build a content-addressed key from everything that influences the LLM output
+def make_cache_key(*parts):
+    digest = hashlib.sha256()
+    for part in parts:
+        data = part if isinstance(part, str) else repr(part)
+        encoded = data.encode("utf-8")
+        # Length-prefix every part so ("ab", "c") and ("a", "bc") never collide
+        digest.update(len(encoded).to_bytes(8, "big"))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+class ResultCache:
+    # SQLite-backed key/value store with TTL expiry and least-recently-used eviction
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=DEFAULT_MAX_BYTES, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    created_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL
+                )
+                """)
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed_at ON results (accessed_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        # Streamlit serves every session from its own thread, so use one connection per operation
+        conn = sqlite3.connect(self.path, timeout=30)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT value, created_at FROM results WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.ttl_seconds and now - row[1] > self.ttl_seconds:
+                conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            conn.execute("UPDATE results SET accessed_at = ? WHERE key = ?", (now, key))
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, value):
+        now = time.time()
+        size = len(value.encode("utf-8"))
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, value, size, now, now),
+            )
+            self._evict(conn, now)
+
+    def _evict(self, conn, now):
+        if self.ttl_seconds:
+            conn.execute("DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,))
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop least recently used entries until the store fits in max_bytes again
+        for key, size in conn.execute("SELECT key, size FROM results ORDER BY accessed_at ASC").fetchall():
+            conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM results")
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            entries, total = conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM results").fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": total}
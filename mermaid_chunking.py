@@ -0,0 +1,159 @@
+import functools
+import logging
+import re
+import zlib
+
+from mermaid_syntax import quote_text, split_mindmap_node
+
+logger = logging.getLogger(__name__)
+
+# Rough characters-per-token ratio used when no tokenizer is available
+CHARS_PER_TOKEN = 4
+
+# Content-defined sections: never cut before this many tokens, then cut after roughly one paragraph in SECTION_BOUNDARY_EVERY
+SECTION_MIN_TOKENS = 500
+SECTION_BOUNDARY_EVERY = 4
+
+# Load the tokenizer for a model once; None when tiktoken or its encoding files are unavailable
+@functools.lru_cache(maxsize=None)
+def get_encoding(model_name):
+    try:
+        import tiktoken
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("cl100k_base")
+    except Exception:
+        logger.warning("No tokenizer available for %s, estimating token counts from length", model_name)
+        return None
+
+# Count the tokens in a piece of text for the given model
+def count_tokens(text, model_name):
+    encoding = get_encoding(model_name)
+    if encoding is None:
+        return -(-len(text) // CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+# Break a single oversized paragraph into sentence- or word-sized pieces
+def _split_paragraph(paragraph, max_tokens, model_name):
+    pieces = re.split(r"(?<=[.!?])\s+", paragraph)
+    if len(pieces) == 1:
+        pieces = paragraph.split()
+    parts, current, current_tokens = [], [], 0
+    for piece in pieces:
+        piece_tokens = count_tokens(piece, model_name) + 1
+        if current and current_tokens + piece_tokens > max_tokens:
+            parts.append(" ".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+    if current:
+        parts.append(" ".join(current))
+    return parts
+
+# Split a piece of text into paragraphs, falling back to lines when there are no blank lines
+def split_paragraphs(text):
+    paragraphs = [p.strip() for p in re.split(r"\n\s*\n", text) if p.strip()]
+    if len(paragraphs) <= 1:
+        paragraphs = [p.strip() for p in text.splitlines() if p.strip()]
+    return paragraphs
+
+# Yield chunks of at most max_tokens tokens as soon as enough text has arrived from an iterable of texts
+def iter_chunks(texts, max_tokens, model_name):
+    current, current_tokens = [], 0
+    for text in texts:
+        for paragraph in split_paragraphs(text):
+            paragraph_tokens = count_tokens(paragraph, model_name)
+            if paragraph_tokens > max_tokens:
+                pieces = _split_paragraph(paragraph, max_tokens, model_name)
+            else:
+                pieces = [paragraph]
+            for piece in pieces:
+                piece_tokens = paragraph_tokens if len(pieces) == 1 else count_tokens(piece, model_name)
+                if current and current_tokens + piece_tokens > max_tokens:
+                    yield "\n\n".join(current)
+                    current, current_tokens = [], 0
+                current.append(piece)
+                current_tokens += piece_tokens
+    if current:
+        yield "\n\n".join(current)
+
+# Pieces of at most max_tokens tokens, with their token counts: whole paragraphs, or parts of oversized ones
+def _pieces(text, max_tokens, model_name):
+    for paragraph in split_paragraphs(text):
+        paragraph_tokens = count_tokens(paragraph, model_name)
+        if paragraph_tokens <= max_tokens:
+            yield paragraph, paragraph_tokens
+        else:
+            for piece in _split_paragraph(paragraph, max_tokens, model_name):
+                yield piece, count_tokens(piece, model_name)
+
+# Whether a paragraph ends a content-defined section; depends only on its own words, not on its position
+def _is_boundary(paragraph):
+    return zlib.crc32(" ".join(paragraph.split()).encode("utf-8")) % SECTION_BOUNDARY_EVERY == 0
+
+# Split text into sections whose boundaries are chosen by content, so an edit only changes the sections around it.
+# Token-budget chunks shift every boundary after an insertion; these resynchronize at the next boundary paragraph.
+def content_defined_sections(text, max_tokens, model_name, min_tokens=SECTION_MIN_TOKENS):
+    sections, current, current_tokens = [], [], 0
+    for piece, piece_tokens in _pieces(text, max_tokens, model_name):
+        if current and current_tokens + piece_tokens > max_tokens:
+            sections.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += piece_tokens
+        if current_tokens >= min_tokens and _is_boundary(piece):
+            sections.append("\n\n".join(current))
+            current, current_tokens = [], 0
+    if current:
+        sections.append("\n\n".join(current))
+    return sections or [text]
+
+# Split text into chunks of at most max_tokens tokens, keeping paragraphs together where possible
+def split_text(text, max_tokens, model_name):
+    return list(iter_chunks([text], max_tokens, model_name)) or [text]
+
+# Parse a cleaned mindmap into its root node and the lines below it, with indentation made relative.
+# Front matter and %% directives before the header are skipped.
+def parse_mindmap(mermaid_code):
+    lines = [line.rstrip() for line in mermaid_code.splitlines() if line.strip()]
+    if lines and lines[0].strip() == "---":
+        end = next((i for i in range(1, len(lines)) if lines[i].strip() == "---"), len(lines) - 1)
+        lines = lines[end + 1:]
+    while lines and lines[0].strip().startswith("%%"):
+        lines = lines[1:]
+    if lines and lines[0].strip() == "mindmap":
+        lines = lines[1:]
+    if not lines:
+        return None, []
+    root = lines[0].strip()
+    children = lines[1:]
+    if not children:
+        return root, []
+    base_indent = min(len(line) - len(line.lstrip()) for line in children)
+    return root, [line[base_indent:] for line in children]
+
+# Turn a root declaration such as root("Title") or A((Title)) into a plain node with the same shape
+def root_as_node(root):
+    opener, label, closer = split_mindmap_node(root)
+    if not label.strip():
+        label = "Untitled section"
+    if not opener:
+        opener, closer = "(", ")"
+    return f"{opener}{quote_text(label)}{closer}"
+
+# Extract the label text of a node declaration
+def node_label(node):
+    return split_mindmap_node(node)[1].strip() or "Document"
+
+# Merge the mindmaps generated for each chunk under one root
+def merge_mindmaps(mermaid_codes, root_label=None, indent="    "):
+    sections = [parse_mindmap(code) for code in mermaid_codes]
+    sections = [(root, children) for root, children in sections if root is not None]
+    if root_label is None:
+        root_label = node_label(sections[0][0]) if sections else "Document"
+    lines = ["mindmap", f"{indent}root({quote_text(root_label)})"]
+    for root, children in sections:
+        lines.append(indent * 2 + root_as_node(root))
+        lines.extend(indent * 3 + child for child in children)
+    return "\n".join(lines)
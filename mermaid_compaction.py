@@ -0,0 +1,252 @@
+import re
+import zlib
+from collections import Counter
+
+from mermaid_chunking import count_tokens
+from mermaid_tracing import span
+
+# Running headers and footers: lines this close to the top or bottom of a page, repeated on this share of pages
+FURNITURE_EDGE_LINES = 3
+FURNITURE_MIN_PAGE_SHARE = 0.5
+MIN_PAGES_FOR_FURNITURE = 3
+# Pages compacted together when they are streamed in, enough for running headers and footers to repeat
+STREAM_BATCH_PAGES = 8
+
+# Near-duplicate paragraphs: word shingles of this size, and the Jaccard similarity at which two count as the same
+SHINGLE_WORDS = 3
+SKETCH_SIZE = 4
+DUPLICATE_SIMILARITY = 0.8
+MIN_WORDS_FOR_NEAR_DUPLICATE = 8
+
+# Headings are short, unpunctuated lines; they are never dropped
+MAX_HEADING_WORDS = 12
+# In PDF text, a heading line is also clearly shorter than the typical (full-width) line
+HEADING_LINE_SHARE = 0.6
+# Sentences longer than this are scored and kept in word windows, so one run-on cannot exceed the whole budget
+SENTENCE_WINDOW_WORDS = 60
+
+STOPWORDS = frozenset(
+    "the and for are but not you all any can had her was one our out has have this that with from they will "
+    "would there their what about which when make like time just him into than them then these some its also "
+    "more other were been such only over most very where after each those being".split()
+)
+
+_PAGE_NUMBER_RE = re.compile(r"^\s*(?:page\s+)?[-–—(\[]?\s*\d+\s*(?:(?:of|/)\s*\d+)?\s*[-–—)\]]?\s*$", re.IGNORECASE)
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+_WORD_RE = re.compile(r"[a-z0-9]+")
+_TERM_RE = re.compile(r"[a-z][a-z0-9]{2,}")
+
+
+def _line_signature(line):
+    return re.sub(r"\d+", "#", " ".join(line.lower().split()))
+
+def _edge_indexes(lines):
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return set(filled[:FURNITURE_EDGE_LINES] + filled[-FURNITURE_EDGE_LINES:])
+
+# Drop running headers, footers and page numbers: lines at the edges of pages that repeat, digits aside, on many pages
+def strip_page_furniture(pages):
+    if len(pages) < MIN_PAGES_FOR_FURNITURE:
+        return pages, 0
+    page_lines = [page.splitlines() for page in pages]
+    counts = Counter()
+    for lines in page_lines:
+        counts.update({_line_signature(lines[i]) for i in _edge_indexes(lines)})
+    threshold = max(2, FURNITURE_MIN_PAGE_SHARE * len(pages))
+    furniture = {signature for signature, count in counts.items() if count >= threshold}
+    cleaned, removed = [], 0
+    for lines in page_lines:
+        edges = _edge_indexes(lines)
+        kept = [
+            line for i, line in enumerate(lines)
+            if i not in edges or not (_line_signature(line) in furniture or _PAGE_NUMBER_RE.match(line))
+        ]
+        removed += len(lines) - len(kept)
+        cleaned.append("\n".join(kept))
+    return cleaned, removed
+
+def is_heading(paragraph):
+    if paragraph.lstrip().startswith("#"):
+        return True
+    words = paragraph.split()
+    return (
+        0 < len(words) <= MAX_HEADING_WORDS
+        and "\n" not in paragraph.strip()
+        and paragraph.rstrip()[-1] not in ".!?,;:"
+        and (paragraph.lstrip()[0].isupper() or paragraph.lstrip()[0].isdigit())
+        and not paragraph.strip().isdigit()
+    )
+
+def _ends_sentence(line):
+    return line.rstrip()[-1:] in (".", "!", "?", ":", ";")
+
+# Rebuild paragraphs from PDF-style text, where every wrapped line is a line of its own and blank lines are rare.
+# A line ends a paragraph when it ends a sentence short of full width; short unpunctuated lines after one are headings.
+def reflow_lines(text):
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    if not lines:
+        return []
+    typical = sorted(len(line) for line in lines)[len(lines) // 2]
+    paragraphs, current = [], []
+
+    def flush():
+        if current:
+            paragraphs.append(" ".join(current))
+            current.clear()
+
+    for line in lines:
+        short = len(line) <= HEADING_LINE_SHARE * typical
+        if short and is_heading(line) and (not current or _ends_sentence(current[-1])):
+            flush()
+            paragraphs.append(line)
+            continue
+        if current and current[-1].endswith("-") and line[:1].islower():
+            # Rejoin a word hyphenated across lines
+            current[-1] = current[-1][:-1] + line
+        else:
+            current.append(line)
+        if _ends_sentence(line) and len(line) < 0.9 * typical:
+            flush()
+    flush()
+    return paragraphs
+
+# Paragraphs of one page: each block between blank lines is reflowed, except tables (lines of cells), which are
+# kept whole. Pages are reflowed one by one so the tables that extract_page_text appends after a blank line do
+# not make the page's wrapped lines look like paragraphs already.
+def page_paragraphs(page):
+    paragraphs = []
+    for block in re.split(r"\n\s*\n", page):
+        lines = [line.strip() for line in block.splitlines() if line.strip()]
+        if lines and all("|" in line for line in lines):
+            paragraphs.append("\n".join(lines))
+        else:
+            paragraphs.extend(reflow_lines(block))
+    return paragraphs
+
+def _shingles(words):
+    if len(words) < SHINGLE_WORDS:
+        return {zlib.crc32(" ".join(words).encode("utf-8"))}
+    return {zlib.crc32(" ".join(words[i:i + SHINGLE_WORDS]).encode("utf-8")) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+# Drop paragraphs that repeat an earlier one word for word, or nearly (bottom-k MinHash candidates, checked by Jaccard).
+# Numbers must match too: paragraphs that differ only in their figures state different facts.
+def drop_near_duplicates(paragraphs):
+    seen_exact = set()
+    by_sketch = {}
+    shingle_sets, numbers_of = [], []
+    kept, dropped = [], 0
+    for paragraph in paragraphs:
+        if is_heading(paragraph):
+            kept.append(paragraph)
+            continue
+        words = _WORD_RE.findall(paragraph.lower())
+        normalized = " ".join(words)
+        if normalized in seen_exact:
+            dropped += 1
+            continue
+        seen_exact.add(normalized)
+        if len(words) >= MIN_WORDS_FOR_NEAR_DUPLICATE:
+            shingles = _shingles(words)
+            numbers = [word for word in words if word.isdigit()]
+            sketch = sorted(shingles)[:SKETCH_SIZE]
+            candidates = {index for value in sketch for index in by_sketch.get(value, ())}
+            if any(numbers_of[i] == numbers
+                   and len(shingles & shingle_sets[i]) / len(shingles | shingle_sets[i]) >= DUPLICATE_SIMILARITY
+                   for i in candidates):
+                dropped += 1
+                continue
+            shingle_sets.append(shingles)
+            numbers_of.append(numbers)
+            for value in sketch:
+                by_sketch.setdefault(value, []).append(len(shingle_sets) - 1)
+        kept.append(paragraph)
+    return kept, dropped
+
+# Keep the highest-scoring sentences that fit in the budget, in their original order. Headings are always kept,
+# and the first sentence of every section goes in before any other, so no section disappears entirely.
+def compress_to_budget(paragraphs, token_budget, model_name):
+    heading_tokens = sum(count_tokens(paragraph, model_name) for paragraph in paragraphs if is_heading(paragraph))
+    sentences = []
+    section_start = True
+    for index, paragraph in enumerate(paragraphs):
+        if is_heading(paragraph):
+            section_start = True
+            continue
+        for sentence in _SENTENCE_RE.split(paragraph):
+            words = sentence.split()
+            for start in range(0, len(words), SENTENCE_WINDOW_WORDS):
+                piece = " ".join(words[start:start + SENTENCE_WINDOW_WORDS])
+                sentences.append({"paragraph": index, "text": piece, "lead": section_start})
+                section_start = False
+    frequencies = Counter(term for sentence in sentences for term in _TERM_RE.findall(sentence["text"].lower())
+                          if term not in STOPWORDS)
+    for order, sentence in enumerate(sentences):
+        terms = {term for term in _TERM_RE.findall(sentence["text"].lower()) if term not in STOPWORDS}
+        sentence["order"] = order
+        sentence["score"] = sum(frequencies[term] for term in terms) / (len(terms) + 1)
+        sentence["tokens"] = count_tokens(sentence["text"], model_name)
+    remaining = token_budget - heading_tokens
+    selected = set()
+    for sentence in sorted(sentences, key=lambda sentence: (not sentence["lead"], -sentence["score"], sentence["order"])):
+        if sentence["tokens"] <= remaining:
+            selected.add(sentence["order"])
+            remaining -= sentence["tokens"]
+    kept_text = {}
+    for sentence in sentences:
+        if sentence["order"] in selected:
+            kept_text.setdefault(sentence["paragraph"], []).append(sentence["text"])
+    compressed = []
+    for index, paragraph in enumerate(paragraphs):
+        if is_heading(paragraph):
+            compressed.append(paragraph)
+        elif index in kept_text:
+            compressed.append(" ".join(kept_text[index]))
+    return compressed, len(sentences) - len(selected)
+
+# Compact extracted text before prompting: strip page furniture and duplicate paragraphs, then, when a token budget
+# is given and still exceeded, compress extractively. pages is a list of page texts, or a single string.
+def compact_text(pages, model_name, token_budget=None):
+    if isinstance(pages, str):
+        pages = [pages]
+    with span("compact", token_budget=token_budget) as s:
+        original = "\n".join(pages)
+        tokens_before = count_tokens(original, model_name)
+        pages, furniture_lines = strip_page_furniture(pages)
+        paragraphs = [paragraph for page in pages for paragraph in page_paragraphs(page)]
+        paragraphs, duplicate_paragraphs = drop_near_duplicates(paragraphs)
+        text = "\n\n".join(paragraphs)
+        dropped_sentences = 0
+        if token_budget and count_tokens(text, model_name) > token_budget:
+            paragraphs, dropped_sentences = compress_to_budget(paragraphs, token_budget, model_name)
+            text = "\n\n".join(paragraphs)
+        report = {
+            "tokens_before": tokens_before,
+            "tokens_after": count_tokens(text, model_name),
+            "furniture_lines": furniture_lines,
+            "duplicate_paragraphs": duplicate_paragraphs,
+            "dropped_sentences": dropped_sentences,
+        }
+        s.set(**report)
+        return text, report
+
+# Compact pages as they are read, batch_pages at a time, yielding the text of each batch. pages yields
+# (page_count, text); every batch gets its share of token_budget by page count, and repeats are only found within
+# a batch. report, if given, is kept up to date with the totals of the batches so far.
+def iter_compacted_pages(pages, model_name, token_budget=None, report=None, batch_pages=STREAM_BATCH_PAGES):
+    batch, page_count = [], 0
+
+    def compact_batch():
+        budget = max(1, token_budget * len(batch) // page_count) if token_budget else None
+        text, batch_report = compact_text(batch, model_name, budget)
+        if report is not None:
+            for key, value in batch_report.items():
+                report[key] = report.get(key, 0) + value
+        return text
+
+    for page_count, text in pages:
+        batch.append(text)
+        if len(batch) == batch_pages:
+            yield compact_batch()
+            batch = []
+    if batch:
+        yield compact_batch()
@@ -0,0 +1,191 @@
+import bisect
+import contextlib
+import contextvars
+import functools
+import itertools
+import os
+import threading
+from concurrent.futures import Future
+
+from mermaid_tracing import span
+
+# LLM calls allowed in flight across every session of this process
+MAX_CONCURRENT_LLM_CALLS = int(os.environ.get("MERMAID_MAX_LLM_CALLS", "8"))
+# How often a waiting caller re-checks its place in the queue, in seconds
+QUEUE_POLL_SECONDS = 0.5
+
+# (session_id, on_wait) of the session whose work runs in this context
+_current_session = contextvars.ContextVar("mermaid_session", default=("anonymous", None))
+
+
+class LeaderFailed(Exception):
+    # Raised to callers waiting on a key whose leader failed; they should run the work themselves. The leader's
+    # own error is not shared, as it may be its own, e.g. a bad or rate-limited API key.
+    pass
+
+
+class SingleFlight:
+    # Deduplicates identical work in flight: the first caller of a key runs it, later callers wait for its result
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    # Returns (future, leader); the leader must settle the future with resolve() or fail(). When the leader fails,
+    # the future raises LeaderFailed
+    def claim(self, key):
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                return future, False
+            future = Future()
+            self._futures[key] = future
+            return future, True
+
+    def resolve(self, key, result):
+        with self._lock:
+            future = self._futures.pop(key)
+        future.set_result(result)
+
+    def fail(self, key):
+        with self._lock:
+            future = self._futures.pop(key)
+        future.set_exception(LeaderFailed(key))
+
+    # Run function once for all concurrent callers of key; returns (result, shared). If the leader fails, each
+    # waiting caller tries again on its own, one of them becoming the next leader
+    def do(self, key, function):
+        while True:
+            future, leader = self.claim(key)
+            if leader:
+                break
+            try:
+                return future.result(), True
+            except LeaderFailed:
+                continue
+        try:
+            result = function()
+        except BaseException:
+            self.fail(key)
+            raise
+        self.resolve(key, result)
+        return result, False
+
+
+class FairLimiter:
+    # Caps concurrent calls and hands free slots out fairly: a session's n-th outstanding call
+    # queues behind every other session's earlier calls, so one large document cannot starve other users
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.active = 0
+        self._condition = threading.Condition()
+        self._waiting = []
+        self._outstanding = {}
+        self._sequence = itertools.count()
+
+    def _position(self, ticket):
+        return bisect.bisect_left(self._waiting, ticket)
+
+    # Wait for a slot; on_wait gets the 1-based place in the queue whenever it changes, and 0 once admitted
+    def acquire(self, session_id, on_wait=None):
+        with self._condition:
+            ticket = (self._outstanding.get(session_id, 0), next(self._sequence), session_id)
+            self._outstanding[session_id] = self._outstanding.get(session_id, 0) + 1
+            bisect.insort(self._waiting, ticket)
+        reported = None
+        try:
+            while True:
+                with self._condition:
+                    position = self._position(ticket)
+                    if position == 0 and self.active < self.max_concurrency:
+                        self._waiting.pop(0)
+                        self.active += 1
+                        break
+                    if position == reported:
+                        self._condition.wait(QUEUE_POLL_SECONDS)
+                        continue
+                reported = position
+                # Report outside the lock; the callback may be slow, e.g. a UI update
+                if on_wait:
+                    on_wait(position + 1)
+        except BaseException:
+            with self._condition:
+                self._waiting.remove(ticket)
+                self._done(session_id)
+            raise
+        if reported is not None and on_wait:
+            on_wait(0)
+
+    # Take a slot only if one is free and nobody is queueing for it; used for optional work such as hedged requests
+    def try_acquire(self, session_id):
+        with self._condition:
+            if self._waiting or self.active >= self.max_concurrency:
+                return False
+            self.active += 1
+            self._outstanding[session_id] = self._outstanding.get(session_id, 0) + 1
+            return True
+
+    def _done(self, session_id):
+        self._outstanding[session_id] -= 1
+        if not self._outstanding[session_id]:
+            del self._outstanding[session_id]
+        self._condition.notify_all()
+
+    def release(self, session_id):
+        with self._condition:
+            self.active -= 1
+            self._done(session_id)
+
+    @contextlib.contextmanager
+    def slot(self, session_id, on_wait=None):
+        self.acquire(session_id, on_wait)
+        try:
+            yield
+        finally:
+            self.release(session_id)
+
+
+_single_flight = SingleFlight()
+_llm_limiter = FairLimiter(MAX_CONCURRENT_LLM_CALLS)
+
+def get_single_flight():
+    return _single_flight
+
+def get_llm_limiter():
+    return _llm_limiter
+
+# Attribute LLM calls made in this context, including on worker threads that copy it, to one user session
+@contextlib.contextmanager
+def llm_session(session_id, on_wait=None):
+    token = _current_session.set((session_id, on_wait))
+    try:
+        yield
+    finally:
+        _current_session.reset(token)
+
+# Wait for one of the process-wide LLM slots for the current session and return a function that gives it back.
+# Time spent queueing gets its own span. The slot may be given back from another thread, e.g. by the request
+# that used it.
+def acquire_llm_slot():
+    session_id, on_wait = _current_session.get()
+    limiter = get_llm_limiter()
+    with span("llm.queue"):
+        limiter.acquire(session_id, on_wait)
+    return functools.partial(limiter.release, session_id)
+
+# Hold one of the process-wide LLM slots for the current session
+@contextlib.contextmanager
+def llm_slot():
+    release = acquire_llm_slot()
+    try:
+        yield
+    finally:
+        release()
+
+# Take a spare LLM slot if one is free right now, for optional work such as a hedged request; returns a function
+# that gives it back, or None
+def take_spare_llm_slot():
+    session_id, _ = _current_session.get()
+    limiter = get_llm_limiter()
+    if not limiter.try_acquire(session_id):
+        return None
+    return functools.partial(limiter.release, session_id)
@@ -111,22 +111,26 @@ mermaid_examples = {
                 }
             ]
         },
-        # {
-        #     "id": 2,
-        #     "title": "User Journey Diagram",
-        #     "description": "User journeys describe at a high level of detail exactly what steps different users take to complete a specific task within a system, application or website. This technique shows the current (as-is) user workflow, and reveals areas of improvement for the to-be workflow.",
-        #     "diagram": """
-        #         journey
-        #             title My working day
-        #             section Go to work
-        #                 Make tea: 5: Me
-        #                 Go upstairs: 3: Me
-        #                 Do work: 1: Me, Cat
-        #             section Go home
-        #                 Go downstairs: 5: Me
-        #                 Sit down: 5: Me
-        #     """
-        # },
+        {
+            "id": 2,
+            "title": "User Journey Diagram",
+            "description": "User journeys describe at a high level of detail exactly what steps different users take to complete a specific task within a system, application or website. This technique shows the current (as-is) user workflow, and reveals areas of improvement for the to-be workflow.",
+            "diagram_examples": [
+                {
+                    """
+                    journey
+                        title My working day
+                        section Go to work
+                            Make tea: 5: Me
+                            Go upstairs: 3: Me
+                            Do work: 1: Me, Cat
+                        section Go home
+                            Go downstairs: 5: Me
+                            Sit down: 5: Me
+                    """
+                }
+            ]
+        },
         {
             "id": 3,
             "title": "Mindmap",
@@ -0,0 +1,121 @@
+import asyncio
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+# Connect and read timeouts, in seconds
+DEFAULT_TIMEOUT = (5, 30)
+DEFAULT_CACHE_DIR = os.path.join(".mermaid_cache", "http")
+MAX_POOL_SIZE = 32
+MAX_CONCURRENT_FETCHES = 8
+
+_session = None
+_session_lock = threading.Lock()
+
+# Advertise brotli only when a decoder is installed, otherwise the body could not be read
+def _accept_encoding():
+    if importlib.util.find_spec("brotli") is not None:
+        return "gzip, deflate, br"
+    return "gzip, deflate"
+
+# Shared session so repeated fetches reuse pooled keep-alive connections
+def get_session():
+    global _session
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            retries = Retry(total=2, backoff_factor=0.5, status_forcelist=[502, 503, 504], allowed_methods=["GET"])
+            adapter = HTTPAdapter(pool_connections=MAX_POOL_SIZE, pool_maxsize=MAX_POOL_SIZE, max_retries=retries)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            session.headers.update({
+                "Accept": "text/html,application/xhtml+xml,text/plain;q=0.9,*/*;q=0.8",
+                "Accept-Encoding": _accept_encoding(),
+            })
+            _session = session
+        return _session
+
+
+class ResponseCache:
+    # File store of response bodies and their validators, keyed by URL
+    def __init__(self, directory=DEFAULT_CACHE_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _paths(self, url):
+        name = hashlib.sha256(url.encode("utf-8")).hexdigest()
+        base = os.path.join(self.directory, name)
+        return base + ".json", base + ".body"
+
+    def get(self, url):
+        meta_path, body_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            with open(body_path, "rb") as file:
+                body = file.read()
+        except (OSError, ValueError):
+            return None, None
+        return meta, body
+
+    def put(self, url, meta, body):
+        meta_path, body_path = self._paths(url)
+        # Write to temporary files first so a concurrent reader never sees a half-written entry
+        for path, data, mode in ((body_path, body, "wb"), (meta_path, json.dumps(meta), "w")):
+            tmp_path = f"{path}.{threading.get_ident()}.tmp"
+            with open(tmp_path, mode) as file:
+                file.write(data)
+            os.replace(tmp_path, path)
+
+
+_default_cache = None
+
+def get_response_cache():
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = ResponseCache()
+    return _default_cache
+
+# Fetch a URL through the shared session, revalidating cached copies with ETag/Last-Modified
+def fetch_url(url, timeout=DEFAULT_TIMEOUT, cache=None):
+    cache = cache or get_response_cache()
+    meta, body = cache.get(url)
+    headers = {}
+    if meta:
+        if meta.get("etag"):
+            headers["If-None-Match"] = meta["etag"]
+        if meta.get("last_modified"):
+            headers["If-Modified-Since"] = meta["last_modified"]
+    response = get_session().get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and body is not None:
+        logger.info("Not modified, using cached copy of %s", url)
+        return body
+    response.raise_for_status()
+    etag = response.headers.get("ETag")
+    last_modified = response.headers.get("Last-Modified")
+    if etag or last_modified:
+        cache.put(url, {"url": url, "etag": etag, "last_modified": last_modified}, response.content)
+    return response.content
+
+# Async variant: run the blocking fetch on a worker thread so many URLs can be in flight at once
+async def fetch_url_async(url, timeout=DEFAULT_TIMEOUT, cache=None):
+    return await asyncio.to_thread(fetch_url, url, timeout, cache)
+
+# Fetch many URLs concurrently; failed fetches are returned as exceptions in the matching position
+async def fetch_many(urls, max_concurrency=MAX_CONCURRENT_FETCHES, timeout=DEFAULT_TIMEOUT, cache=None):
+    semaphore = asyncio.Semaphore(max_concurrency)
+
+    async def fetch(url):
+        async with semaphore:
+            return await fetch_url_async(url, timeout, cache)
+
+    return await asyncio.gather(*(fetch(url) for url in urls), return_exceptions=True)
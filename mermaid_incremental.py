@@ -0,0 +1,125 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+
+from mermaid_cache import make_cache_key
+from mermaid_chunking import content_defined_sections, merge_mindmaps, node_label, parse_mindmap
+from mermaid_pipeline import (
+    MAX_CHUNK_TOKENS,
+    agenerate_chunk_mermaid_code,
+    chunk_prompt_template,
+    generate_chunks,
+    get_result_cache,
+)
+from mermaid_syntax import clean_mermaid_code
+from mermaid_tracing import span
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MANIFEST_DIR = os.path.join(".mermaid_cache", "manifests")
+
+
+class ManifestStore:
+    # One JSON manifest per (source, model): the hash and generated subtree of every section of the last version
+    def __init__(self, directory=DEFAULT_MANIFEST_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, source_id, model_name):
+        return os.path.join(self.directory, make_cache_key(source_id, model_name) + ".json")
+
+    def get(self, source_id, model_name):
+        try:
+            with open(self._path(source_id, model_name), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, source_id, model_name, manifest):
+        path = self._path(source_id, model_name)
+        # Write to a temporary file first so a concurrent reader never sees a half-written manifest
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+        os.replace(tmp_path, path)
+
+
+_manifest_store = None
+
+def get_manifest_store():
+    global _manifest_store
+    if _manifest_store is None:
+        _manifest_store = ManifestStore()
+    return _manifest_store
+
+# Hash of a section's words, so reflowed whitespace in a re-crawled page does not count as a change.
+# The selected examples are left out on purpose: they follow the whole text and would change on any edit.
+def section_hash(section, model_name):
+    return make_cache_key(" ".join(section.split()), model_name, chunk_prompt_template)
+
+# Split the new text into sections and find the ones the previous manifest has no subtree for
+def plan_regeneration(text, previous, model_name, max_chunk_tokens=MAX_CHUNK_TOKENS):
+    sections = content_defined_sections(text, max_chunk_tokens, model_name)
+    hashes = [section_hash(section, model_name) for section in sections]
+    known = {entry["hash"]: entry["code"] for entry in previous["sections"]} if previous else {}
+    missing = [i for i, section_key in enumerate(hashes) if section_key not in known]
+    return sections, hashes, known, missing
+
+# Splice reused and regenerated subtrees together in document order, store the new manifest and report the diff
+def _splice(source_id, model_name, previous, hashes, known, missing, generated, store):
+    codes = dict(known)
+    for i, result in zip(missing, generated):
+        codes[hashes[i]] = clean_mermaid_code(result)
+    section_codes = [codes[section_key] for section_key in hashes]
+    if len(section_codes) == 1:
+        mermaid_code = section_codes[0]
+        root_label = node_label(parse_mindmap(mermaid_code)[0] or "")
+    else:
+        # Keep the document's root label across versions, even when its first section changed, but only for
+        # what is still recognizably the same document: at least one of its sections is unchanged
+        root_label = previous["root_label"] if previous and len(missing) < len(hashes) else None
+        with span("merge", sections=len(section_codes)):
+            mermaid_code = merge_mindmaps(section_codes, root_label=root_label)
+        root_label = root_label or node_label(parse_mindmap(mermaid_code)[0])
+    store.put(source_id, model_name, {
+        "source": source_id,
+        "model": model_name,
+        "root_label": root_label,
+        "sections": [{"hash": section_key, "code": codes[section_key]} for section_key in hashes],
+    })
+    previous_hashes = {entry["hash"] for entry in previous["sections"]} if previous else set()
+    report = {
+        "sections": len(hashes),
+        "reused": len(hashes) - len(missing),
+        "generated": len(missing),
+        "removed": len(previous_hashes - set(hashes)),
+    }
+    logger.info("Incremental regeneration of %s: %s", source_id, report)
+    return mermaid_code, report
+
+# Regenerate only the sections of a document that changed since it was last converted, reusing the rest
+def regenerate_incremental(text, source_id, examples, api_key, model_name, store=None, max_chunk_tokens=MAX_CHUNK_TOKENS):
+    store = store or get_manifest_store()
+    with span("generate.incremental", source=source_id) as s:
+        previous = store.get(source_id, model_name)
+        sections, hashes, known, missing = plan_regeneration(text, previous, model_name, max_chunk_tokens)
+        s.set(sections=len(sections), regenerated=len(missing))
+        generated = generate_chunks([sections[i] for i in missing], examples, api_key, model_name)
+        return _splice(source_id, model_name, previous, hashes, known, missing, generated, store)
+
+# Async counterpart of regenerate_incremental; limiter, if given, is entered around every LLM call
+async def aregenerate_incremental(text, source_id, examples, api_key, model_name, limiter=None, store=None,
+                                  max_chunk_tokens=MAX_CHUNK_TOKENS):
+    store = store or get_manifest_store()
+    with span("generate.incremental", source=source_id) as s:
+        previous = store.get(source_id, model_name)
+        sections, hashes, known, missing = plan_regeneration(text, previous, model_name, max_chunk_tokens)
+        s.set(sections=len(sections), regenerated=len(missing))
+        cache = get_result_cache()
+        generated = await asyncio.gather(*(
+            agenerate_chunk_mermaid_code(sections[i], chunk_prompt_template, examples, api_key, model_name, cache, limiter)
+            for i in missing
+        ))
+        return _splice(source_id, model_name, previous, hashes, known, missing, generated, store)
@@ -0,0 +1,460 @@
+import contextlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+
+import requests
+
+from mermaid_chunking import count_tokens, iter_chunks
+from mermaid_compaction import compact_text, iter_compacted_pages
+from mermaid_concurrency import llm_session
+from mermaid_incremental import regenerate_incremental
+from mermaid_pdf import extract_pdf_pages, iter_pdf_pages, pdf_page_count
+from mermaid_pipeline import (
+    DIAGRAM_TYPES,
+    MAX_CHUNK_TOKENS,
+    fetch_text,
+    generate_diagrams,
+    generate_mermaid_code_from_chunks,
+    prompt_templates,
+    stream_mermaid_code,
+)
+from mermaid_registry import get_example_index
+from mermaid_render import RenderError, render_diagram, renderer_available
+from mermaid_selector import select_examples
+from mermaid_syntax import MermaidSyntaxError, clean_mermaid_code
+from mermaid_tracing import span, trace
+from mermaid_uploads import (
+    UploadRejected,
+    check_upload,
+    get_pdf_memory_budget,
+    pdf_extraction_plan,
+    pdf_memory_estimate,
+    remove_upload,
+)
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOBS_PATH = os.path.join(".mermaid_cache", "jobs.sqlite3")
+EXAMPLES_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "mermaid_examples.py")
+
+# Background conversions run at once in this process; LLM calls are still capped by the shared limiter
+JOB_WORKERS = int(os.environ.get("MERMAID_JOB_WORKERS", "2"))
+# How often an idle worker looks for new jobs, in seconds
+WORKER_POLL_SECONDS = 0.5
+# Running jobs prove they are alive this often; a job silent for STALE_AFTER_SECONDS lost its worker
+# (the server restarted or crashed) and is queued again, at most MAX_JOB_ATTEMPTS times in all
+HEARTBEAT_SECONDS = 5
+STALE_AFTER_SECONDS = 60
+MAX_JOB_ATTEMPTS = 3
+# Minimum time between saves of the partial Mermaid code while tokens stream in
+PARTIAL_SAVE_SECONDS = 1.0
+# Finished jobs are deleted after this long, checked this often
+JOB_TTL_SECONDS = 7 * 24 * 60 * 60
+PURGE_EVERY_SECONDS = 60 * 60
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class JobError(RuntimeError):
+    # A job failed in a way the user can act on; the message is shown as is
+    pass
+
+
+class JobStore:
+    # SQLite-backed queue of conversion jobs, shared by every session and worker process on this machine
+    def __init__(self, path=DEFAULT_JOBS_PATH):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    params TEXT NOT NULL,
+                    progress TEXT,
+                    partial TEXT,
+                    result TEXT,
+                    error TEXT,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    created_at REAL NOT NULL,
+                    started_at REAL,
+                    finished_at REAL,
+                    heartbeat_at REAL
+                )
+                """)
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created_at ON jobs (status, created_at)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def submit(self, params, job_id=None):
+        job_id = job_id or uuid.uuid4().hex
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT INTO jobs (id, status, params, progress, created_at) VALUES (?, ?, ?, ?, ?)",
+                (job_id, QUEUED, json.dumps(params), "Waiting for a worker", time.time()),
+            )
+        return job_id
+
+    # The job as a dict, with params and result decoded and, while queued, its place in the queue
+    def get(self, job_id):
+        with self._connect() as conn:
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = dict(row)
+            if job["status"] == QUEUED:
+                job["position"] = conn.execute(
+                    "SELECT COUNT(*) FROM jobs WHERE status = ? AND created_at <= ?", (QUEUED, job["created_at"])
+                ).fetchone()[0]
+        job["params"] = json.loads(job["params"])
+        job["result"] = json.loads(job["result"]) if job["result"] else None
+        return job
+
+    # Take the oldest queued job for worker, or None when the queue is empty
+    def claim(self, worker):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute(
+                """
+                UPDATE jobs SET status = ?, worker = ?, started_at = ?, heartbeat_at = ?, attempts = attempts + 1,
+                    progress = 'Starting'
+                WHERE id = (SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1)
+                RETURNING id, params, attempts
+                """,
+                (RUNNING, worker, now, now, QUEUED),
+            ).fetchone()
+        if row is None:
+            return None
+        return {"id": row["id"], "params": json.loads(row["params"]), "attempts": row["attempts"]}
+
+    def set_progress(self, job_id, progress=None, partial=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET progress = COALESCE(?, progress), partial = COALESCE(?, partial), heartbeat_at = ? "
+                "WHERE id = ?",
+                (progress, partial, time.time(), job_id),
+            )
+
+    def heartbeat(self, job_ids):
+        with self._connect() as conn:
+            conn.executemany("UPDATE jobs SET heartbeat_at = ? WHERE id = ?", [(time.time(), job_id) for job_id in job_ids])
+
+    def finish(self, job_id, result):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, result = ?, progress = 'Done', partial = NULL, finished_at = ? WHERE id = ?",
+                (DONE, json.dumps(result), time.time(), job_id),
+            )
+
+    def fail(self, job_id, error, result=None):
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, result = ?, partial = NULL, finished_at = ? WHERE id = ?",
+                (FAILED, error, json.dumps(result) if result else None, time.time(), job_id),
+            )
+
+    # Queue running jobs whose worker stopped sending heartbeats again, or fail them after too many attempts
+    def requeue_stale(self, stale_after=STALE_AFTER_SECONDS):
+        cutoff = time.time() - stale_after
+        with self._connect() as conn:
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = 'The conversion was interrupted too many times', finished_at = ? "
+                "WHERE status = ? AND heartbeat_at < ? AND attempts >= ?",
+                (FAILED, time.time(), RUNNING, cutoff, MAX_JOB_ATTEMPTS),
+            )
+            return conn.execute(
+                "UPDATE jobs SET status = ?, progress = 'Interrupted, waiting for a worker' "
+                "WHERE status = ? AND heartbeat_at < ?",
+                (QUEUED, RUNNING, cutoff),
+            ).rowcount
+
+    # Delete finished jobs older than ttl_seconds; returns their params so uploads can be removed too
+    def purge(self, ttl_seconds=JOB_TTL_SECONDS):
+        cutoff = time.time() - ttl_seconds
+        with self._connect() as conn:
+            rows = conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ? RETURNING params", (DONE, FAILED, cutoff)
+            ).fetchall()
+        return [json.loads(row["params"]) for row in rows]
+
+
+def _remove_upload(params):
+    if params.get("upload"):
+        remove_upload(params["upload"])
+
+
+# A failure as shown to the user
+def describe_error(error):
+    if isinstance(error, (JobError, UploadRejected)):
+        return str(error)
+    if isinstance(error, MermaidSyntaxError):
+        return f"The generated diagram could not be parsed ({error}). Please try again."
+    return f"{type(error).__name__}: {error}"
+
+# Clean one generated diagram and pre-render it on the server when the Mermaid CLI is installed
+def _finish_diagram(diagram, mermaid_code):
+    with span("clean", diagram_type=diagram["type"], characters=len(mermaid_code)) as clean_span:
+        diagram["mermaid_code"] = clean_mermaid_code(mermaid_code)
+        clean_span.set(lines=diagram["mermaid_code"].count("\n") + 1)
+    # Without an SVG the browser lays the diagram out
+    diagram["svg"] = None
+    if renderer_available():
+        try:
+            diagram["svg"] = render_diagram(diagram["mermaid_code"], "svg").decode("utf-8")
+        except RenderError as e:
+            logger.warning("Server-side rendering failed, rendering in the browser instead: %s", e)
+
+# What the previous version of a source is stored under for incremental regeneration. A URL names the same page
+# for everyone, but upload names such as report.pdf do not, so uploads are only matched within one session.
+def manifest_source_id(params):
+    if params["source_type"] == "pdf":
+        return f"upload:{params.get('session_id', '')}:{params['source_name']}"
+    return params["source_name"]
+
+# Convert one job: extract and compact the source once, then generate, clean and pre-render every diagram type.
+# params mirrors the options in the UI; progress(message=None, partial=None) reports how far it got.
+def run_conversion(params, api_key, progress):
+    model_name = params["model_name"]
+    source_type = params["source_type"]
+    source = params["upload"] if source_type == "pdf" else params["source"]
+    diagram_types = params.get("diagram_types") or ["mindmap"]
+    example_index = get_example_index(EXAMPLES_PATH)
+    result = {}
+    # {diagram_type: (mermaid_code, examples_report)}, or the exception that stopped it
+    generated = {}
+    if source_type == "pdf":
+        size = os.path.getsize(source)
+        check_upload(size, params["source_name"])
+        memory = get_pdf_memory_budget()
+
+        def wait_for_memory():
+            progress("Waiting for memory to read the PDF")
+
+    if source_type == "pdf" and params.get("stream_pages") and not params.get("incremental") and diagram_types == ["mindmap"]:
+        # Report each page as it is read
+        def pages():
+            for page_number, page_count, page_text in iter_pdf_pages(source, params.get("include_tables", False)):
+                progress(f"Read page {page_number} of {page_count}")
+                yield page_count, page_text
+
+        if params.get("compact", True):
+            result["compaction"] = {}
+            texts = iter_compacted_pages(pages(), model_name, params.get("token_budget") or None, result["compaction"])
+        else:
+            texts = (page_text for page_count, page_text in pages())
+        mermaid_examples, examples_report = select_examples(example_index, "mindmap", model_name=model_name)
+        chunks = iter_chunks(texts, MAX_CHUNK_TOKENS, model_name)
+        # The file stays open while its pages are generated, in this one process
+        with memory.reserve(pdf_memory_estimate(size), on_wait=wait_for_memory):
+            mermaid_code = generate_mermaid_code_from_chunks(chunks, mermaid_examples, api_key, model_name)
+        generated["mindmap"] = (mermaid_code, examples_report)
+    else:
+        progress("Reading the source")
+        if source_type == "pdf":
+            # Opening the file to count its pages takes one process's worth of memory
+            with memory.reserve(pdf_memory_estimate(size), on_wait=wait_for_memory):
+                page_count = pdf_page_count(source)
+            workers, reserved = pdf_extraction_plan(size, page_count)
+            with memory.reserve(reserved, on_wait=wait_for_memory):
+                progress("Reading the source")
+                pages = extract_pdf_pages(source, include_tables=params.get("include_tables", False), max_workers=workers)
+        else:
+            # A page that cannot be fetched fails the job rather than becoming a diagram of an error message
+            try:
+                pages = [fetch_text(source)]
+            except requests.RequestException as e:
+                raise JobError(f"Could not fetch {source}: {e}") from e
+        if params.get("compact", True):
+            text, result["compaction"] = compact_text(pages, model_name, params.get("token_budget") or None)
+        else:
+            text = "\n".join(pages)
+        progress("Generating Mermaid code")
+        remaining = list(diagram_types)
+        if params.get("incremental") and "mindmap" in remaining:
+            remaining.remove("mindmap")
+            mermaid_examples, examples_report = select_examples(example_index, "mindmap", text, model_name=model_name)
+            mermaid_code, result["incremental"] = regenerate_incremental(
+                text, manifest_source_id(params), mermaid_examples, api_key, model_name
+            )
+            generated["mindmap"] = (mermaid_code, examples_report)
+        # A single diagram of a short text is streamed; long mindmaps are split into concurrent chunks instead
+        if len(remaining) == 1 and params.get("stream_output") and count_tokens(text, model_name) <= MAX_CHUNK_TOKENS:
+            diagram_type = remaining.pop()
+            mermaid_examples, examples_report = select_examples(example_index, diagram_type, text, model_name=model_name)
+            mermaid_code, last_save = "", 0.0
+            for mermaid_code in stream_mermaid_code(
+                text, mermaid_examples, api_key, model_name, prompt_templates[diagram_type]
+            ):
+                if time.monotonic() - last_save >= PARTIAL_SAVE_SECONDS:
+                    progress(partial=mermaid_code)
+                    last_save = time.monotonic()
+            generated[diagram_type] = (mermaid_code, examples_report)
+        if remaining:
+            generated.update(generate_diagrams(text, remaining, example_index, api_key, model_name))
+
+    progress("Cleaning and rendering")
+    result["diagrams"] = []
+    failures = []
+    for diagram_type in diagram_types:
+        diagram = {"type": diagram_type, "title": DIAGRAM_TYPES[diagram_type]["title"]}
+        try:
+            if isinstance(generated[diagram_type], Exception):
+                raise generated[diagram_type]
+            mermaid_code, diagram["examples"] = generated[diagram_type]
+            _finish_diagram(diagram, mermaid_code)
+        except Exception as e:
+            diagram["error"] = describe_error(e)
+            failures.append(e)
+        result["diagrams"].append(diagram)
+    # The job only fails when no diagram could be made
+    if len(failures) == len(diagram_types):
+        raise failures[0]
+    return result
+
+
+class JobWorkers:
+    # Background threads that take jobs off the store and convert them, plus one thread for heartbeats.
+    # API keys are only ever held in memory: a job outliving the process that queued it falls back to OPENAI_API_KEY.
+    def __init__(self, store, workers=JOB_WORKERS):
+        self.store = store
+        self.workers = workers
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._api_keys = {}
+        self._running = set()
+        self._lock = threading.Lock()
+        self._started = False
+
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        self._purge()
+        self._requeue_stale()
+        for number in range(self.workers):
+            threading.Thread(target=self._work, name=f"mermaid-job-{number}", daemon=True).start()
+        threading.Thread(target=self._beat, name="mermaid-job-heartbeat", daemon=True).start()
+
+    # The key is registered before the job is queued, so a worker never claims the job without it
+    def submit(self, params, api_key):
+        job_id = uuid.uuid4().hex
+        with self._lock:
+            self._api_keys[job_id] = api_key
+        try:
+            return self.store.submit(params, job_id)
+        except BaseException:
+            with self._lock:
+                self._api_keys.pop(job_id, None)
+            raise
+
+    def _purge(self):
+        for params in self.store.purge():
+            _remove_upload(params)
+
+    def _requeue_stale(self):
+        requeued = self.store.requeue_stale()
+        if requeued:
+            logger.info("Queued %d interrupted jobs again", requeued)
+
+    # Keep running jobs alive, queue jobs of dead workers again and delete expired ones
+    def _beat(self):
+        last_purge = time.monotonic()
+        while True:
+            time.sleep(HEARTBEAT_SECONDS)
+            try:
+                with self._lock:
+                    running = list(self._running)
+                if running:
+                    self.store.heartbeat(running)
+                self._requeue_stale()
+                if time.monotonic() - last_purge >= PURGE_EVERY_SECONDS:
+                    last_purge = time.monotonic()
+                    self._purge()
+            except sqlite3.Error:
+                logger.exception("Job heartbeat failed")
+
+    def _work(self):
+        while True:
+            job = self.store.claim(self.name)
+            if job is None:
+                time.sleep(WORKER_POLL_SECONDS)
+                continue
+            with self._lock:
+                self._running.add(job["id"])
+                api_key = self._api_keys.pop(job["id"], None)
+            try:
+                self._run(job, api_key or os.environ.get("OPENAI_API_KEY"))
+            finally:
+                with self._lock:
+                    self._running.discard(job["id"])
+
+    def _run(self, job, api_key):
+        job_id, params = job["id"], job["params"]
+
+        def progress(message=None, partial=None):
+            self.store.set_progress(job_id, message, partial)
+
+        def on_wait(position):
+            progress(f"Waiting for a free model slot: number {position} in the queue" if position else "Generating Mermaid code")
+
+        error = None
+        with trace("conversion", job_id=job_id, source_type=params["source_type"], model=params["model_name"]) as tracer:
+            try:
+                if not api_key:
+                    raise JobError("The API key for this job is no longer available. Please submit it again.")
+                # LLM slots are shared fairly between the sessions that submitted the jobs
+                with llm_session(params.get("session_id", job_id), on_wait=on_wait):
+                    result = run_conversion(params, api_key, progress)
+            except (JobError, UploadRejected, MermaidSyntaxError) as e:
+                error = describe_error(e)
+            except Exception as e:
+                logger.exception("Job %s failed", job_id)
+                error = describe_error(e)
+            finally:
+                _remove_upload(params)
+        # Spans are only complete once the trace is closed
+        if error is None:
+            result["trace"] = tracer.summary()
+            self.store.finish(job_id, result)
+        else:
+            self.store.fail(job_id, error, {"trace": tracer.summary()})
+
+
+_job_store = None
+_job_workers = None
+_singletons_lock = threading.Lock()
+
+def get_job_store():
+    global _job_store
+    with _singletons_lock:
+        if _job_store is None:
+            _job_store = JobStore()
+        return _job_store
+
+# The worker pool of this process, started on first use
+def get_job_workers():
+    global _job_workers
+    store = get_job_store()
+    with _singletons_lock:
+        if _job_workers is None:
+            _job_workers = JobWorkers(store)
+    _job_workers.start()
+    return _job_workers
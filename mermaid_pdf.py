@@ -0,0 +1,131 @@
+import contextlib
+import io
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pdfplumber
+
+from mermaid_tracing import span
+
+# Documents with fewer pages than this are extracted in-process, where a pool costs more than it saves
+MIN_PAGES_FOR_POOL = 16
+
+# Worker processes are started by a fork server rather than forked from this process: the app and the batch
+# converter are multi-threaded, and a forked child can deadlock on a lock another thread held (logging, sqlite).
+# The server imports this module once, so each worker starts without paying for the pdfplumber import.
+if "forkserver" in multiprocessing.get_all_start_methods():
+    PROCESS_CONTEXT = multiprocessing.get_context("forkserver")
+    PROCESS_CONTEXT.set_forkserver_preload([__name__])
+else:
+    PROCESS_CONTEXT = multiprocessing.get_context("spawn")
+
+# Render a table extracted by pdfplumber as pipe-separated text
+def table_to_text(table):
+    rows = []
+    for row in table:
+        rows.append(" | ".join("" if cell is None else str(cell).replace("\n", " ") for cell in row))
+    return "\n".join(rows)
+
+# Extract the text (and optionally the tables) of a single page
+def extract_page_text(page, include_tables=False):
+    text = page.extract_text() or ""
+    if include_tables:
+        tables = [table_to_text(table) for table in page.extract_tables()]
+        text = "\n\n".join([text] + [table for table in tables if table])
+    return text
+
+# Document being extracted by this worker process, set once by the pool initializer
+_worker_source = None
+
+def _init_worker(source):
+    global _worker_source
+    _worker_source = source
+
+def _extract_worker_range(start, stop, include_tables):
+    return _extract_page_range(_worker_source, start, stop, include_tables)
+
+# Open a PDF with pdfplumber. Files on disk are memory-mapped, so their bytes are paged in on demand and
+# live in the OS page cache, which the kernel can reclaim, rather than being copied into this process's heap.
+@contextlib.contextmanager
+def open_pdf(source, **kwargs):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            with pdfplumber.open(mapped, **kwargs) as pdf:
+                yield pdf
+        return
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with pdfplumber.open(source, **kwargs) as pdf:
+        yield pdf
+
+# Open the document and extract a contiguous range of pages
+def _extract_page_range(source, start, stop, include_tables):
+    with open_pdf(source, pages=list(range(start + 1, stop + 1))) as pdf:
+        texts = []
+        for page in pdf.pages:
+            texts.append(extract_page_text(page, include_tables))
+            page.close()
+        return texts
+
+# Yield (page_number, page_count, text) for each page in order, releasing every page once it is read
+def iter_pdf_pages(file_path, include_tables=False):
+    if hasattr(file_path, "seek"):
+        file_path.seek(0)
+    with open_pdf(file_path) as pdf:
+        page_count = len(pdf.pages)
+        for page_number, page in enumerate(pdf.pages, start=1):
+            text = extract_page_text(page, include_tables)
+            page.close()
+            yield page_number, page_count, text
+
+# Read an uploaded file, path or file object into something a worker process can open
+def _as_worker_source(file):
+    if isinstance(file, (str, os.PathLike)):
+        return os.fspath(file)
+    if hasattr(file, "getvalue"):
+        return file.getvalue()
+    file.seek(0)
+    return file.read()
+
+def pdf_page_count(file_path):
+    with open_pdf(_as_worker_source(file_path)) as pdf:
+        return len(pdf.pages)
+
+# Processes extract_pdf_pages uses for a document of page_count pages: short documents are read in-process
+def pdf_worker_count(page_count, max_workers=None):
+    if page_count < MIN_PAGES_FOR_POOL:
+        return 1
+    return max(1, min(max_workers or os.cpu_count() or 1, page_count))
+
+# Extract the text of every page as a list, fanning page ranges out across a process pool
+def extract_pdf_pages(file_path, include_tables=False, max_workers=None):
+    with span("extract.pdf", include_tables=include_tables) as s:
+        source = _as_worker_source(file_path)
+        with open_pdf(source) as pdf:
+            page_count = len(pdf.pages)
+        max_workers = pdf_worker_count(page_count, max_workers)
+        if max_workers == 1:
+            texts = _extract_page_range(source, 0, page_count, include_tables)
+        else:
+            # A few ranges per worker keeps the pool busy when some pages are much slower than others
+            range_count = min(page_count, max_workers * 4)
+            bounds = [page_count * i // range_count for i in range(range_count + 1)]
+            # The document is shipped to each worker once rather than with every page range
+            with ProcessPoolExecutor(
+                max_workers=max_workers, mp_context=PROCESS_CONTEXT, initializer=_init_worker, initargs=(source,)
+            ) as executor:
+                futures = [
+                    executor.submit(_extract_worker_range, start, stop, include_tables)
+                    for start, stop in zip(bounds, bounds[1:])
+                ]
+                texts = [text for future in futures for text in future.result()]
+        s.set(pages=page_count, characters=sum(len(text) for text in texts))
+        if isinstance(source, bytes):
+            s.set(bytes=len(source))
+        return texts
+
+# Extract the text of the whole document
+def process_pdf(file_path, include_tables=False, max_workers=None):
+    return "\n".join(extract_pdf_pages(file_path, include_tables, max_workers))
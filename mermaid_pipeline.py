@@ -0,0 +1,420 @@
+import asyncio
+import contextvars
+import requests
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from mermaid_cache import ResultCache, make_cache_key
+from mermaid_concurrency import LeaderFailed, get_single_flight, llm_slot
+from mermaid_chunking import count_tokens, merge_mindmaps, split_text
+from mermaid_compaction import compact_text
+from mermaid_fetch import fetch_url
+from mermaid_pdf import process_pdf
+from mermaid_registry import get_prompt
+from mermaid_routing import RETRYABLE_ERRORS, ainvoke_with_retries, invoke_with_retries, route_llms
+from mermaid_selector import select_examples
+from mermaid_syntax import MermaidSyntaxError, clean_mermaid_code, extract_code
+from mermaid_text import html_to_text, markdown_to_text
+from mermaid_tracing import span
+
+# Attempts at getting valid Mermaid code out of the model before giving up
+MAX_GENERATION_ATTEMPTS = 2
+
+# Chunked generation settings
+MAX_CHUNK_TOKENS = 4000
+MAX_CONCURRENT_CHUNKS = 8
+
+logger = logging.getLogger(__name__)
+
+# Fetch a URL and extract its text; raises requests.RequestException when the page cannot be fetched
+def fetch_text(url):
+    with span("extract.url", url=url) as s:
+        # Sessions converting the same URL at the same time share one download
+        page_content, shared = get_single_flight().do(make_cache_key("fetch", url), lambda: fetch_url(url))
+        text = html_to_text(page_content)
+        s.set(bytes=len(page_content), characters=len(text), coalesced=shared)
+        return text
+
+# Function to scrape text from a URL
+def scrape_text(url):
+    try:
+        return fetch_text(url)
+    except requests.RequestException as e:
+        logger.warning("Failed to fetch %s: %s", url, e)
+        return "Failed to scrape the website"
+
+# Function to load a markdown file
+def load_markdown_as_text(file_path):
+    with span("extract.markdown") as s:
+        with open(file_path, 'r', encoding='utf-8') as file:
+            markdown_content = file.read()
+        text = markdown_to_text(markdown_content)
+        s.set(bytes=len(markdown_content.encode('utf-8')), characters=len(text))
+        return text
+
+# Load content
+def load_content(source, source_type):
+    if source_type == 'pdf':
+        return process_pdf(source)
+    elif source_type == 'url':
+        return scrape_text(source)
+    elif source_type == 'markdown':
+        return load_markdown_as_text(source)
+    else:
+        raise ValueError("""
+            Invalid source type. 
+            Use "pdf" or "url".
+            """)
+
+# Fill in a prompt template, recording its size in the active trace
+def format_prompt(template, examples, text, model_name):
+    with span("prompt.format") as s:
+        formatted_prompt = get_prompt(template).format(examples=examples, text=text)
+        s.set(characters=len(formatted_prompt), tokens=count_tokens(formatted_prompt, model_name))
+        return formatted_prompt
+
+# Record response size and token usage on an LLM span
+def _record_response(s, response):
+    s.set(response_characters=len(response.content))
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        s.set(input_tokens=usage.get("input_tokens"), output_tokens=usage.get("output_tokens"))
+
+# Check a response parses, recording the outcome on the LLM span
+def _is_valid(s, content, attempt):
+    try:
+        clean_mermaid_code(content)
+        s.set(valid=True)
+        return True
+    except MermaidSyntaxError as e:
+        s.set(valid=False)
+        logger.warning("Attempt %d returned invalid Mermaid code: %s", attempt, e)
+        if attempt == MAX_GENERATION_ATTEMPTS:
+            raise
+        return False
+
+# Invoke the model again, straight away, whenever its response is not valid Mermaid code.
+# Attempts after the first go to fallback_llm when given, e.g. a stronger model than the one that failed.
+def invoke_until_valid(llm, formatted_prompt, fallback_llm=None):
+    for attempt in range(1, MAX_GENERATION_ATTEMPTS + 1):
+        current = llm if attempt == 1 or fallback_llm is None else fallback_llm
+        with span("llm.invoke", model=current.model_name, attempt=attempt) as s:
+            response = invoke_with_retries(current, formatted_prompt, s)
+            _record_response(s, response)
+            if _is_valid(s, response.content, attempt):
+                return response.content
+
+# Async counterpart of invoke_until_valid; limiter, if given, is entered around every request to the model
+async def ainvoke_until_valid(llm, formatted_prompt, fallback_llm=None, limiter=None):
+    for attempt in range(1, MAX_GENERATION_ATTEMPTS + 1):
+        current = llm if attempt == 1 or fallback_llm is None else fallback_llm
+        with span("llm.invoke", model=current.model_name, attempt=attempt) as s:
+            response = await ainvoke_with_retries(current, formatted_prompt, s, limiter)
+            _record_response(s, response)
+            if _is_valid(s, response.content, attempt):
+                return response.content
+
+# Function to generate Mermaid code; template defaults to the mindmap prompt
+def generate_mermaid_code(text, examples, api_key, model_name, template=None):
+    template = template or prompt_template
+    formatted_prompt = format_prompt(template, examples, text, model_name)
+    llm, fallback_llm = route_llms(api_key, model_name, formatted_prompt)
+    return invoke_until_valid(llm, formatted_prompt, fallback_llm)
+
+# Shared on-disk cache of generated Mermaid code, reused across sessions and restarts
+_result_cache = None
+
+def get_result_cache():
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache()
+    return _result_cache
+
+# Generate Mermaid code, reusing a previous result for the same text, model, prompt and examples.
+# Identical requests already in flight in another session wait for that one instead of calling the model again.
+def generate_mermaid_code_cached(text, examples, api_key, model_name, template=None):
+    template = template or prompt_template
+    cache = get_result_cache()
+    key = make_cache_key(text, model_name, template, examples)
+    with span("generate.document", characters=len(text)) as s:
+        result = cache.get(key)
+        s.set(cache_hit=result is not None)
+        if result is None:
+            result, shared = get_single_flight().do(
+                key, lambda: _generate_and_store(cache, key, text, examples, api_key, model_name, template)
+            )
+            s.set(coalesced=shared)
+        return result
+
+def _generate_and_store(cache, key, text, examples, api_key, model_name, template):
+    result = generate_mermaid_code(text, examples, api_key, model_name, template)
+    cache.put(key, result)
+    return result
+
+# Stream Mermaid code as the model produces it, yielding the accumulated response after every token.
+# When another session is already generating the same diagram, wait for its result instead.
+def stream_mermaid_code(text, examples, api_key, model_name, template=None):
+    template = template or prompt_template
+    cache = get_result_cache()
+    key = make_cache_key(text, model_name, template, examples)
+    cached = cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    flight = get_single_flight()
+    while True:
+        future, leader = flight.claim(key)
+        if leader:
+            break
+        try:
+            with span("generate.document", characters=len(text), coalesced=True):
+                result = future.result()
+        except LeaderFailed:
+            # The other session failed or stopped reading; generate it here, or wait for whoever took over
+            continue
+        yield result
+        return
+    try:
+        content = yield from _stream_and_validate(text, examples, api_key, model_name, template)
+    except BaseException:
+        flight.fail(key)
+        raise
+    cache.put(key, content)
+    flight.resolve(key, content)
+
+def _stream_and_validate(text, examples, api_key, model_name, template):
+    formatted_prompt = format_prompt(template, examples, text, model_name)
+    llm, fallback_llm = route_llms(api_key, model_name, formatted_prompt)
+    parts = []
+    try:
+        with llm_slot(), span("llm.stream", model=llm.model_name) as s:
+            stream_start = time.perf_counter()
+            for message_chunk in llm.stream(formatted_prompt):
+                if message_chunk.content:
+                    if not parts:
+                        s.set(first_token_ms=round((time.perf_counter() - stream_start) * 1000, 3))
+                    parts.append(message_chunk.content)
+                    yield "".join(parts)
+            content = "".join(parts)
+            s.set(response_characters=len(content))
+    except RETRYABLE_ERRORS as e:
+        if parts:
+            raise
+        # Nothing was shown yet, so regular calls can retry and back off without the user noticing
+        logger.warning("Streaming failed before the first token: %s", e)
+        content = invoke_until_valid(llm, formatted_prompt, fallback_llm)
+        yield content
+        return content
+    try:
+        clean_mermaid_code(content)
+    except MermaidSyntaxError as e:
+        # Fall back to regular calls rather than streaming the retry too
+        logger.warning("Streamed response is not valid Mermaid code: %s", e)
+        content = invoke_until_valid(fallback_llm, formatted_prompt)
+        yield content
+    return content
+
+# Generate the mindmap of one section of a larger document, reusing a cached or in-flight result for the same section
+def generate_chunk_mermaid_code(chunk, examples, api_key, model_name, cache):
+    key = make_cache_key(chunk, model_name, chunk_prompt_template, examples)
+    with span("generate.chunk", characters=len(chunk)) as s:
+        result = cache.get(key)
+        s.set(cache_hit=result is not None)
+        if result is None:
+            result, shared = get_single_flight().do(key, lambda: _generate_chunk_and_store(cache, key, chunk, examples, api_key, model_name))
+            s.set(coalesced=shared)
+        return result
+
+def _generate_chunk_and_store(cache, key, chunk, examples, api_key, model_name):
+    formatted_prompt = format_prompt(chunk_prompt_template, examples, chunk, model_name)
+    llm, fallback_llm = route_llms(api_key, model_name, formatted_prompt)
+    result = invoke_until_valid(llm, formatted_prompt, fallback_llm)
+    cache.put(key, result)
+    return result
+
+# Generate every chunk on a thread pool, starting each one as soon as the iterable produces it
+def generate_chunks(chunks, examples, api_key, model_name):
+    cache = get_result_cache()
+    with ThreadPoolExecutor(max_workers=MAX_CONCURRENT_CHUNKS) as executor:
+        # Each task runs in a copy of this context so its spans join the active trace
+        futures = [
+            executor.submit(
+                contextvars.copy_context().run,
+                generate_chunk_mermaid_code, chunk, examples, api_key, model_name, cache,
+            )
+            for chunk in chunks
+        ]
+        return [future.result() for future in futures]
+
+# Generate the chunks concurrently, then merge the sections in order
+def generate_mermaid_code_from_chunks(chunks, examples, api_key, model_name):
+    results = generate_chunks(chunks, examples, api_key, model_name)
+    if len(results) == 1:
+        return results[0]
+    with span("merge", sections=len(results)):
+        return merge_mindmaps([clean_mermaid_code(result) for result in results])
+
+# Generate one mindmap per chunk concurrently and merge them; short texts use a single call
+def generate_mermaid_code_chunked(text, examples, api_key, model_name, max_chunk_tokens=MAX_CHUNK_TOKENS):
+    if count_tokens(text, model_name) <= max_chunk_tokens:
+        return generate_mermaid_code_cached(text, examples, api_key, model_name)
+    chunks = split_text(text, max_chunk_tokens, model_name)
+    logger.info("Split %d characters into %d chunks", len(text), len(chunks))
+    return generate_mermaid_code_from_chunks(chunks, examples, api_key, model_name)
+
+# Async counterpart of generate_chunk_mermaid_code; limiter, if given, is entered around every request to the model
+async def agenerate_chunk_mermaid_code(chunk, template, examples, api_key, model_name, cache, limiter=None):
+    key = make_cache_key(chunk, model_name, template, examples)
+    with span("generate.chunk", characters=len(chunk)) as s:
+        result = cache.get(key)
+        s.set(cache_hit=result is not None)
+        if result is None:
+            formatted_prompt = format_prompt(template, examples, chunk, model_name)
+            llm, fallback_llm = route_llms(api_key, model_name, formatted_prompt)
+            result = await ainvoke_until_valid(llm, formatted_prompt, fallback_llm, limiter)
+            cache.put(key, result)
+        return result
+
+# Async counterpart of generate_mermaid_code_chunked; limiter, if given, is entered around every request to the model
+async def agenerate_mermaid_code_chunked(text, examples, api_key, model_name, limiter=None, max_chunk_tokens=MAX_CHUNK_TOKENS):
+    if count_tokens(text, model_name) <= max_chunk_tokens:
+        template, chunks = prompt_template, [text]
+    else:
+        template, chunks = chunk_prompt_template, split_text(text, max_chunk_tokens, model_name)
+    cache = get_result_cache()
+    results = await asyncio.gather(*(
+        agenerate_chunk_mermaid_code(chunk, template, examples, api_key, model_name, cache, limiter)
+        for chunk in chunks
+    ))
+    if len(results) == 1:
+        return results[0]
+    with span("merge", sections=len(results)):
+        return merge_mindmaps([clean_mermaid_code(result) for result in results])
+
+# Generate one diagram of the given type. Mindmaps of long texts are generated in chunks and merged; other
+# diagram types cannot be merged, so their text is compressed to fit a single prompt instead.
+def generate_diagram(text, diagram_type, examples, api_key, model_name, max_chunk_tokens=MAX_CHUNK_TOKENS):
+    if diagram_type == "mindmap":
+        return generate_mermaid_code_chunked(text, examples, api_key, model_name, max_chunk_tokens)
+    if count_tokens(text, model_name) > max_chunk_tokens:
+        text, _ = compact_text(text, model_name, max_chunk_tokens)
+    return generate_mermaid_code_cached(text, examples, api_key, model_name, prompt_templates[diagram_type])
+
+# Generate several diagram types for the same text concurrently, each with its own prompt and examples.
+# Returns {diagram_type: (mermaid_code, examples_report)}; an exception is returned in place of a type that failed.
+def generate_diagrams(text, diagram_types, example_index, api_key, model_name):
+    def generate(diagram_type):
+        with span("generate.diagram", diagram_type=diagram_type):
+            examples, report = select_examples(example_index, diagram_type, text, model_name=model_name)
+            return generate_diagram(text, diagram_type, examples, api_key, model_name), report
+
+    with ThreadPoolExecutor(max_workers=len(diagram_types)) as executor:
+        futures = {
+            diagram_type: executor.submit(contextvars.copy_context().run, generate, diagram_type)
+            for diagram_type in diagram_types
+        }
+        results = {}
+        for diagram_type, future in futures.items():
+            try:
+                results[diagram_type] = future.result()
+            except Exception as e:
+                logger.warning("Generating the %s failed: %s", diagram_type, e)
+                results[diagram_type] = e
+        return results
+
+# Diagram types that can be generated: the name shown to users, the diagram to design and how to write its text
+DIAGRAM_TYPES = {
+    "mindmap": {
+        "title": "Mindmap",
+        "design": "a detailed mindmap of the document with all the topics identified",
+        "formatting": 'Enclose all text in a node between "". Here\'s an example: ("Text in a node")',
+    },
+    "flowchart": {
+        "title": "Flowchart",
+        "design": "a flowchart of the main process in the document, with its steps, decisions and outcomes",
+        "formatting": 'Enclose all text in a node between "". Here\'s an example: A["Text in a node"]',
+    },
+    "sequence": {
+        "title": "Sequence diagram",
+        "design": "a sequence diagram of the interactions between the people, systems or components in the document, in the order they happen",
+        "formatting": "Give participants short ids without spaces, and aliases for longer names. Here's an example: participant API as Payments API",
+    },
+    "journey": {
+        "title": "User journey",
+        "design": "a user journey of the steps users take in the document, grouped into sections and scored from 1 (bad) to 5 (good)",
+        "formatting": "Write every step as task: score: actors. Here's an example: Open the app: 4: Customer",
+    },
+}
+
+# Define the prompt template
+_prompt_template = """
+You are a helpful assistant that generates Mermaid code for diagrams. 
+Here are some examples of Mermaid diagrams:
+
+{{examples}}
+
+Based on the text below, perform the following steps.
+1. Identify the entire list of topics or ideas contained in the document
+2. Design {design}
+3. Generate the corresponding Mermaid code.
+
+Text: {{text}}
+
+Provide only the Mermaid code. 
+
+Formatting rules:
+1. Use only ASCII-safe characters in your response.
+2. {formatting}
+"""
+
+# One prompt template per diagram type
+prompt_templates = {
+    diagram_type: _prompt_template.format(design=spec["design"], formatting=spec["formatting"])
+    for diagram_type, spec in DIAGRAM_TYPES.items()
+}
+prompt_template = prompt_templates["mindmap"]
+
+# Prompt used for each section when a long document is split into chunks
+chunk_prompt_template = """
+You are a helpful assistant that generates Mermaid code for diagrams. 
+Here are some examples of Mermaid diagrams:
+
+{examples}
+
+The text below is one section of a larger document. Based on it, perform the following steps.
+1. Identify the entire list of topics or ideas contained in this section
+2. Design a detailed mindmap of the section with all the topics identified, with a root node naming the section
+3. Generate the corresponding Mermaid code.
+
+Text: {text}
+
+Provide only the Mermaid code. 
+
+Formatting rules:
+1. Use only ASCII-safe characters in your response.
+2. Enclose all text in a node between "". Here's an example: ("Text in a node")
+"""
+
+# Longest prefix of partially generated code that forms a renderable diagram, or None if there is none yet
+def complete_prefix(mermaid_code):
+    lines = extract_code(mermaid_code).splitlines()
+    # The last line may still be growing unless the model already moved on to the next one
+    if lines and not mermaid_code.endswith("\n"):
+        lines = lines[:-1]
+    complete = []
+    open_blocks = 0
+    for line in lines:
+        stripped = line.strip()
+        if stripped.count('"') % 2 or any(stripped.count(o) != stripped.count(c) for o, c in ("()", "[]", "{}")):
+            break
+        if stripped.startswith("subgraph "):
+            open_blocks += 1
+        elif stripped == "end" and open_blocks:
+            open_blocks -= 1
+        complete.append(line)
+    # Close any subgraphs that are still open so the prefix parses on its own
+    complete.extend(["end"] * open_blocks)
+    try:
+        return clean_mermaid_code("\n".join(complete))
+    except MermaidSyntaxError:
+        return None
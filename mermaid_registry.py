@@ -0,0 +1,42 @@
+import functools
+import importlib.util
+import os
+import threading
+
+from langchain_openai import ChatOpenAI
+from langchain.prompts import PromptTemplate
+
+from mermaid_selector import ExampleIndex
+
+# Indexed example files by absolute path: (mtime, index)
+_examples = {}
+_examples_lock = threading.Lock()
+
+# Execute an examples file and return its mermaid_examples dict
+def _exec_examples(file_path):
+    spec = importlib.util.spec_from_file_location("mermaid_examples", file_path)
+    mermaid_examples_module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mermaid_examples_module)
+    return mermaid_examples_module.mermaid_examples
+
+# Load an examples file and index it once, reloading only when the file changes on disk
+def get_example_index(file_path):
+    path = os.path.abspath(file_path)
+    mtime = os.stat(path).st_mtime_ns
+    with _examples_lock:
+        entry = _examples.get(path)
+        if entry is None or entry[0] != mtime:
+            entry = (mtime, ExampleIndex(_exec_examples(path)))
+            _examples[path] = entry
+        return entry[1]
+
+# Compiled prompt templates, keyed by template text
+@functools.lru_cache(maxsize=None)
+def get_prompt(template):
+    return PromptTemplate.from_template(template=template)
+
+# One client per (api_key, model_name) so connection pools and setup are shared between requests.
+# The client does not retry by itself; mermaid_routing owns the retry policy.
+@functools.lru_cache(maxsize=32)
+def get_llm(api_key, model_name):
+    return ChatOpenAI(api_key=api_key, model_name=model_name, max_retries=0)
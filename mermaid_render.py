@@ -0,0 +1,175 @@
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+
+import requests
+
+from mermaid_cache import make_cache_key
+from mermaid_tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Pinned Mermaid release; the vendored bundle, the CDN fallback and the render cache keys all use it
+MERMAID_VERSION = "11.4.1"
+MERMAID_CDN_URL = f"https://cdn.jsdelivr.net/npm/mermaid@{MERMAID_VERSION}/dist/mermaid.min.js"
+FONT_AWESOME_CSS_URL = "https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.1/css/all.min.css"
+
+# Streamlit serves ./static at app/static when server.enableStaticServing is on (see .streamlit/config.toml)
+STATIC_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "static")
+VENDORED_BUNDLE = os.path.join(STATIC_DIR, "mermaid.min.js")
+VENDORED_BUNDLE_URL = "app/static/mermaid.min.js"
+
+DEFAULT_RENDER_DIR = os.path.join(".mermaid_cache", "renders")
+RENDER_TIMEOUT_SECONDS = 60
+RENDER_FORMATS = ("svg", "png")
+
+
+class RenderError(RuntimeError):
+    pass
+
+
+# Browser-side render timing, shown under the diagram; the server never sees this stage
+RENDER_TIMING_SCRIPT = """
+    <div id="mermaid-render-time" style="font: 12px sans-serif; color: #888;"></div>
+    <script>
+    const renderStart = performance.now();
+    mermaid.initialize({startOnLoad: false});
+    mermaid.run({querySelector: "#mermaid-chart"}).then(() => {
+        const elapsed = Math.round(performance.now() - renderStart);
+        document.getElementById("mermaid-render-time").textContent = `Rendered in ${elapsed} ms`;
+    });
+    </script>
+    """
+
+# Where the browser loads mermaid.js from: the vendored bundle when it is present, else the CDN
+def mermaid_script_src():
+    return VENDORED_BUNDLE_URL if os.path.exists(VENDORED_BUNDLE) else MERMAID_CDN_URL
+
+# HTML that renders the diagram in the browser; Font Awesome is only loaded for diagrams that use icons
+def mermaid_chart_html(mermaid_code_content, show_render_time=False):
+    init_script = RENDER_TIMING_SCRIPT if show_render_time else "<script>mermaid.initialize({startOnLoad:true});</script>"
+    stylesheet = f'<link rel="stylesheet" href="{FONT_AWESOME_CSS_URL}">' if "::icon(" in mermaid_code_content else ""
+    html_code = f"""
+    {stylesheet}
+    <div class="mermaid" id="mermaid-chart">{mermaid_code_content}</div>
+    <script src="{mermaid_script_src()}"></script>
+    {init_script}
+    """
+    return html_code
+
+# Download the pinned mermaid.js bundle into ./static, for machines that cannot reach the CDN at render time
+def vendor_mermaid_bundle(url=MERMAID_CDN_URL, path=VENDORED_BUNDLE):
+    response = requests.get(url, timeout=(5, 60))
+    response.raise_for_status()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as file:
+        file.write(response.content)
+    os.replace(tmp_path, path)
+    return path
+
+# Mermaid CLI executable used for server-side rendering, or None when it is not installed
+def find_renderer():
+    return os.environ.get("MMDC") or shutil.which("mmdc")
+
+def renderer_available():
+    return find_renderer() is not None
+
+
+class RenderCache:
+    # Rendered SVG/PNG files, named by the hash of everything that affects the output
+    def __init__(self, directory=DEFAULT_RENDER_DIR):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, key, fmt):
+        return os.path.join(self.directory, f"{key}.{fmt}")
+
+    def get(self, key, fmt):
+        try:
+            with open(self.path(key, fmt), "rb") as file:
+                return file.read()
+        except OSError:
+            return None
+
+    def put(self, key, fmt, data):
+        path = self.path(key, fmt)
+        # Write to a temporary file first so a concurrent reader never sees a half-written render
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, path)
+
+
+_render_cache = None
+
+def get_render_cache():
+    global _render_cache
+    if _render_cache is None:
+        _render_cache = RenderCache()
+    return _render_cache
+
+# Run the Mermaid CLI on one diagram and return the output file's bytes
+def _run_renderer(mermaid_code, fmt, scale, background):
+    executable = find_renderer()
+    if executable is None:
+        raise RenderError("server-side rendering needs the Mermaid CLI (mmdc); install @mermaid-js/mermaid-cli or set MMDC")
+    with tempfile.TemporaryDirectory() as directory:
+        input_path = os.path.join(directory, "diagram.mmd")
+        output_path = os.path.join(directory, f"diagram.{fmt}")
+        with open(input_path, "w", encoding="utf-8") as file:
+            file.write(mermaid_code)
+        command = [executable, "-i", input_path, "-o", output_path, "-b", background, "-s", str(scale)]
+        # Chromium usually needs --no-sandbox in containers; point MMDC_PUPPETEER_CONFIG at a config that sets it
+        if os.environ.get("MMDC_PUPPETEER_CONFIG"):
+            command += ["-p", os.environ["MMDC_PUPPETEER_CONFIG"]]
+        try:
+            subprocess.run(command, check=True, capture_output=True, timeout=RENDER_TIMEOUT_SECONDS)
+        except subprocess.CalledProcessError as e:
+            raise RenderError(e.stderr.decode("utf-8", "replace").strip() or f"mmdc exited with {e.returncode}") from e
+        except subprocess.TimeoutExpired as e:
+            raise RenderError(f"mmdc did not finish within {RENDER_TIMEOUT_SECONDS} seconds") from e
+        with open(output_path, "rb") as file:
+            return file.read()
+
+# Render a diagram to SVG or PNG on the server, reusing an earlier render of the same diagram and settings
+def render_diagram(mermaid_code, fmt="svg", scale=1, background="white", cache=None):
+    if fmt not in RENDER_FORMATS:
+        raise ValueError(f"Unsupported render format {fmt!r}; use one of {', '.join(RENDER_FORMATS)}")
+    cache = cache or get_render_cache()
+    key = make_cache_key(mermaid_code, fmt, scale, background, MERMAID_VERSION)
+    with span("render.server", format=fmt, scale=scale) as s:
+        data = cache.get(key, fmt)
+        s.set(cache_hit=data is not None)
+        if data is None:
+            data = _run_renderer(mermaid_code, fmt, scale, background)
+            cache.put(key, fmt, data)
+        s.set(bytes=len(data))
+        return data
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Vendor the mermaid.js bundle or render a diagram file.")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("vendor", help=f"download mermaid.js {MERMAID_VERSION} into {STATIC_DIR}")
+    render_parser = subparsers.add_parser("render", help="render a .mmd file to SVG or PNG")
+    render_parser.add_argument("input")
+    render_parser.add_argument("output")
+    render_parser.add_argument("--scale", type=int, default=1)
+    args = parser.parse_args(argv)
+    if args.command == "vendor":
+        print(f"Saved {vendor_mermaid_bundle()}")
+    else:
+        with open(args.input, "r", encoding="utf-8") as file:
+            mermaid_code = file.read()
+        fmt = os.path.splitext(args.output)[1].lstrip(".").lower()
+        data = render_diagram(mermaid_code, fmt, args.scale)
+        with open(args.output, "wb") as file:
+            file.write(data)
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,188 @@
+import asyncio
+import contextlib
+import contextvars
+import logging
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import openai
+
+from mermaid_chunking import count_tokens
+from mermaid_concurrency import MAX_CONCURRENT_LLM_CALLS, acquire_llm_slot, take_spare_llm_slot
+from mermaid_registry import get_llm
+
+logger = logging.getLogger(__name__)
+
+# "auto" starts on the fast model and escalates to the strong one for long prompts or invalid output
+AUTO_MODEL = "auto"
+FAST_MODEL = "gpt-4o-mini"
+STRONG_MODEL = "gpt-4o"
+ROUTE_PROMPT_TOKENS = 6000
+
+# Transient API errors are retried with full-jitter exponential backoff, or after the server's Retry-After
+MAX_RETRIES = 3
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+RETRYABLE_ERRORS = (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError)
+
+# Hedging is opt-in: it pays for a second, identical request when the first is slow, and the slowest calls are
+# usually the longest and most expensive generations. MERMAID_HEDGE_AFTER_SECONDS turns it on with a fixed delay
+# in seconds, or "auto" for this percentile of recent calls to the same model.
+HEDGE_AFTER_SECONDS = os.environ.get("MERMAID_HEDGE_AFTER_SECONDS", "off")
+HEDGE_PERCENTILE = 95
+MIN_HEDGE_SAMPLES = 20
+LATENCY_WINDOW = 200
+
+
+class LatencyTracker:
+    # Recent successful call latencies per model
+    def __init__(self, window=LATENCY_WINDOW):
+        self.window = window
+        self._lock = threading.Lock()
+        self._samples = {}
+
+    def record(self, model_name, seconds):
+        with self._lock:
+            self._samples.setdefault(model_name, deque(maxlen=self.window)).append(seconds)
+
+    # The q-th percentile latency of a model, or None until there are enough samples to trust it
+    def percentile(self, model_name, q):
+        with self._lock:
+            samples = sorted(self._samples.get(model_name, ()))
+        if len(samples) < MIN_HEDGE_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * q / 100))]
+
+
+_latencies = LatencyTracker()
+# Every request on this pool holds an LLM slot, so it never needs more threads than there are slots
+_hedge_pool = ThreadPoolExecutor(max_workers=MAX_CONCURRENT_LLM_CALLS, thread_name_prefix="mermaid-hedge")
+
+# Models to use for a prompt: the one to call first, and the one to call again when its output is not valid
+def route(model_name, prompt_tokens):
+    if model_name != AUTO_MODEL:
+        return model_name, model_name
+    if prompt_tokens > ROUTE_PROMPT_TOKENS:
+        return STRONG_MODEL, STRONG_MODEL
+    return FAST_MODEL, STRONG_MODEL
+
+def route_llms(api_key, model_name, formatted_prompt):
+    tokens_model = FAST_MODEL if model_name == AUTO_MODEL else model_name
+    primary, fallback = route(model_name, count_tokens(formatted_prompt, tokens_model))
+    return get_llm(api_key, primary), get_llm(api_key, fallback)
+
+def hedge_delay(model_name):
+    if HEDGE_AFTER_SECONDS == "off":
+        return None
+    if HEDGE_AFTER_SECONDS == "auto":
+        return _latencies.percentile(model_name, HEDGE_PERCENTILE)
+    return float(HEDGE_AFTER_SECONDS)
+
+def retry_delay(error, retry):
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after") if response is not None else None
+    try:
+        return min(float(retry_after), BACKOFF_MAX_SECONDS)
+    except (TypeError, ValueError):
+        return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** retry))
+
+def _timed_invoke(llm, formatted_prompt):
+    start = time.perf_counter()
+    response = llm.invoke(formatted_prompt)
+    _latencies.record(llm.model_name, time.perf_counter() - start)
+    return response
+
+# One request in an LLM slot that is already held; the slot is given back only once the request has finished
+def _invoke_and_release(llm, formatted_prompt, release):
+    try:
+        return _timed_invoke(llm, formatted_prompt)
+    finally:
+        release()
+
+# One request holding its own permit of limiter, if given, for as long as it runs
+async def _atimed_invoke(llm, formatted_prompt, limiter=None):
+    async with limiter or contextlib.nullcontext():
+        start = time.perf_counter()
+        response = await llm.ainvoke(formatted_prompt)
+    _latencies.record(llm.model_name, time.perf_counter() - start)
+    return response
+
+# Call the model in an LLM slot, starting a hedge request if it is slow and a spare slot is free; the first
+# success wins. Each request holds its own slot until it finishes: a losing thread cannot be cancelled, so it
+# keeps counting against the cap while it runs.
+def invoke_hedged(llm, formatted_prompt, s):
+    delay = hedge_delay(llm.model_name)
+    release = acquire_llm_slot()
+    if delay is None:
+        return _invoke_and_release(llm, formatted_prompt, release)
+    primary = _hedge_pool.submit(contextvars.copy_context().run, _invoke_and_release, llm, formatted_prompt, release)
+    if wait([primary], timeout=delay).done:
+        return primary.result()
+    release_spare = take_spare_llm_slot()
+    if release_spare is None:
+        return primary.result()
+    s.set(hedged=True)
+    hedge = _hedge_pool.submit(contextvars.copy_context().run, _invoke_and_release, llm, formatted_prompt, release_spare)
+    pending = {primary, hedge}
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is None:
+                s.set(hedge_won=future is hedge)
+                return future.result()
+    return primary.result()
+
+# Async counterpart of invoke_hedged; every request, the hedge included, takes its own permit of limiter, if given.
+# The losing request is cancelled, which gives its permit back.
+async def ainvoke_hedged(llm, formatted_prompt, s, limiter=None):
+    primary = asyncio.ensure_future(_atimed_invoke(llm, formatted_prompt, limiter))
+    delay = hedge_delay(llm.model_name)
+    if delay is None:
+        return await primary
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+    s.set(hedged=True)
+    hedge = asyncio.ensure_future(_atimed_invoke(llm, formatted_prompt, limiter))
+    pending = {primary, hedge}
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    s.set(hedge_won=task is hedge)
+                    return task.result()
+    finally:
+        for task in pending:
+            task.cancel()
+    return primary.result()
+
+# Call the model, retrying transient errors; s is the LLM span, which records retries and hedging
+def invoke_with_retries(llm, formatted_prompt, s):
+    for retry in range(MAX_RETRIES + 1):
+        try:
+            return invoke_hedged(llm, formatted_prompt, s)
+        except RETRYABLE_ERRORS as e:
+            if retry == MAX_RETRIES:
+                raise
+            delay = retry_delay(e, retry)
+            s.set(retries=retry + 1)
+            logger.warning("%s from %s, retrying in %.2fs", type(e).__name__, llm.model_name, delay)
+            time.sleep(delay)
+
+# Async counterpart of invoke_with_retries; limiter, if given, is entered around every request but not the backoff
+async def ainvoke_with_retries(llm, formatted_prompt, s, limiter=None):
+    for retry in range(MAX_RETRIES + 1):
+        try:
+            return await ainvoke_hedged(llm, formatted_prompt, s, limiter)
+        except RETRYABLE_ERRORS as e:
+            if retry == MAX_RETRIES:
+                raise
+            delay = retry_delay(e, retry)
+            s.set(retries=retry + 1)
+            logger.warning("%s from %s, retrying in %.2fs", type(e).__name__, llm.model_name, delay)
+            await asyncio.sleep(delay)
@@ -0,0 +1,108 @@
+import re
+import textwrap
+from collections import Counter
+
+from mermaid_chunking import count_tokens
+
+# Number of examples put in a prompt by default
+DEFAULT_EXAMPLE_COUNT = 2
+
+# Diagram type named by the first keyword of a Mermaid diagram; register_diagram_type adds more
+DIAGRAM_KEYWORDS = {
+    "mindmap": "mindmap",
+    "sequenceDiagram": "sequence",
+    "flowchart": "flowchart",
+    "graph": "flowchart",
+    "journey": "journey",
+}
+
+def register_diagram_type(diagram_type, *keywords):
+    for keyword in keywords:
+        DIAGRAM_KEYWORDS[keyword] = diagram_type
+
+_WORD_RE = re.compile(r"[a-z][a-z0-9]{2,}")
+
+def _terms(text):
+    return Counter(_WORD_RE.findall(text.lower()))
+
+# The example files store each diagram as a one-element set of strings
+def _example_code(example):
+    if isinstance(example, (set, frozenset, list, tuple)):
+        example = next(iter(example), "")
+    return textwrap.dedent(example).strip()
+
+# Diagram type of a piece of Mermaid code, skipping any front matter block
+def diagram_type_of(code):
+    in_front_matter = False
+    for line in code.splitlines():
+        stripped = line.strip()
+        if stripped == "---":
+            in_front_matter = not in_front_matter
+            continue
+        if not stripped or in_front_matter or stripped.startswith("%%"):
+            continue
+        return DIAGRAM_KEYWORDS.get(stripped.split()[0])
+    return None
+
+
+class ExampleIndex:
+    # Flat index of every example in mermaid_examples, tagged with its diagram type and terms
+    def __init__(self, examples):
+        self.examples = examples
+        self._all_tokens = {}
+        self.entries = []
+        for diagram in examples["diagrams"]:
+            for example in diagram.get("diagram_examples", []):
+                code = _example_code(example)
+                self.entries.append({
+                    "type": diagram_type_of(code),
+                    "title": diagram["title"],
+                    "description": diagram["description"],
+                    "code": code,
+                    "terms": _terms(diagram["description"] + "\n" + code),
+                })
+
+    # Tokens taken by the full examples dict in a prompt, counted once per model
+    def all_tokens(self, model_name):
+        if model_name not in self._all_tokens:
+            self._all_tokens[model_name] = count_tokens(str(self.examples), model_name)
+        return self._all_tokens[model_name]
+
+    # Top-k examples of the requested type, ranked by term overlap with the input text
+    def select(self, diagram_type, text="", k=DEFAULT_EXAMPLE_COUNT):
+        candidates = [entry for entry in self.entries if entry["type"] == diagram_type] or self.entries
+        text_terms = _terms(text)
+
+        def score(entry):
+            if not text_terms:
+                return 0.0
+            overlap = sum(min(count, text_terms[term]) for term, count in entry["terms"].items())
+            return overlap / (sum(entry["terms"].values()) or 1)
+
+        ranked = sorted(enumerate(candidates), key=lambda item: (-score(item[1]), item[0]))
+        return [entry for _, entry in ranked[:k]]
+
+# Render selected examples the way they are shown in the prompt
+def format_examples(entries):
+    sections, described = [], set()
+    for entry in entries:
+        # Describe each diagram type once, however many of its examples were picked
+        if entry["title"] not in described:
+            sections.append(f"{entry['title']}: {entry['description']}")
+            described.add(entry["title"])
+        sections.append(entry["code"])
+    return "\n\n".join(sections)
+
+# Pick the examples for one prompt and report how many prompt tokens this saves over sending them all
+def select_examples(index, diagram_type="mindmap", text="", k=DEFAULT_EXAMPLE_COUNT, model_name="gpt-4o-mini"):
+    entries = index.select(diagram_type, text, k)
+    selected = format_examples(entries)
+    all_tokens = index.all_tokens(model_name)
+    selected_tokens = count_tokens(selected, model_name)
+    report = {
+        "examples": len(entries),
+        "all_tokens": all_tokens,
+        "selected_tokens": selected_tokens,
+        "saved_tokens": all_tokens - selected_tokens,
+    }
+    return selected, report
@@ -0,0 +1,294 @@
+import re
+
+# Diagram keywords accepted as the first line of a diagram; only mindmaps and flowcharts are normalized
+DIAGRAM_HEADERS = {
+    "mindmap", "flowchart", "graph", "sequenceDiagram", "classDiagram", "stateDiagram", "stateDiagram-v2",
+    "erDiagram", "journey", "gantt", "pie", "timeline", "quadrantChart", "gitGraph",
+}
+
+# Typographic quotes models like to emit, mapped to ASCII
+QUOTE_TRANSLATION = str.maketrans({
+    "‘": "'", "’": "'", "“": "'", "”": "'",
+})
+
+INDENT = "    "
+
+# Mindmap node shapes: opening delimiter -> closing delimiter, longest first
+MINDMAP_SHAPES = {"((": "))", "))": "((", "{{": "}}", "(": ")", ")": "(", "[": "]"}
+_MINDMAP_NODE_RE = re.compile(r'([^\s()\[\]{}"]*)(\(\(|\)\)|\{\{|\(|\)|\[)')
+# A mindmap node whose label opens with a quote, and the end of a node whose quoted label closes
+_MINDMAP_QUOTED_LABEL_RE = re.compile(r'\s*[^\s()\[\]{}"]*(?:\(\(|\)\)|\{\{|\(|\)|\[)\s*"')
+_MINDMAP_LABEL_END_RE = re.compile(r'"\s*(?:\)\)|\(\(|\}\}|\)|\(|\])$')
+
+# Flowchart node shapes: opening delimiter -> accepted closing delimiters, longest first
+FLOWCHART_SHAPES = [
+    ("(((", (")))",)), ("((", ("))",)), ("([", ("])",)), ("[[", ("]]",)), ("[(", (")]",)),
+    ("[/", ("/]", "\\]")), ("[\\", ("\\]", "/]")), ("{{", ("}}",)),
+    ("[", ("]",)), ("(", (")",)), ("{", ("}",)), (">", ("]",)),
+]
+_FLOWCHART_PASSTHROUGH = ("classDef ", "class ", "style ", "linkStyle ", "click ", "direction ", "%%")
+_END_ID_RE = re.compile(r"(?<![\w-])end(?![\w-])")
+_ID_CHAR_RE = re.compile(r"[\w-]")
+_FLOWCHART_SPECIAL_RE = re.compile(r'["|\[\](){}>]')
+
+
+class MermaidSyntaxError(ValueError):
+    def __init__(self, message, line_number=None):
+        if line_number is not None:
+            message = f"line {line_number}: {message}"
+        super().__init__(message)
+        self.line_number = line_number
+
+
+# Pull the diagram out of a model response: the first fenced block if there is one, else the whole text
+def extract_code(response):
+    lines = response.splitlines()
+    start = next((i for i, line in enumerate(lines) if line.lstrip().startswith("```")), None)
+    if start is None:
+        body = lines
+    else:
+        # Anything after the backticks on the opening fence is an info string such as "mermaid"
+        opening = lines[start].strip().strip("`").strip()
+        end = next((i for i in range(start + 1, len(lines)) if lines[i].strip().startswith("```")), len(lines))
+        body = lines[start + 1:end]
+        if opening and opening != "mermaid":
+            body = [opening] + body
+    # Some responses name the language on a line of its own instead of on the fence
+    while body and body[0].strip() in ("", "mermaid"):
+        body = body[1:]
+    return "\n".join(line.rstrip() for line in body).strip("\n")
+
+# Quote node text, turning inner double quotes into single quotes; markdown strings are kept as they are
+def quote_text(text):
+    text = text.strip()
+    if len(text) >= 2 and text[0] == text[-1] == '"':
+        text = text[1:-1]
+    if len(text) >= 2 and text[0] == text[-1] == "`":
+        return f'"{text}"'
+    return '"' + text.replace('"', "'") + '"'
+
+def _indent_width(line):
+    width = 0
+    for char in line:
+        if char == " ":
+            width += 1
+        elif char == "\t":
+            width += 4
+        else:
+            break
+    return width
+
+# Join lines that continue a quoted multi-line label, yielding (line_number_offset, line).
+# A line with an odd number of quotes only starts a continuation if opens_label(line) says its label opens with
+# a quote; the label must then be closed before the input ends.
+def _logical_lines(lines, first_line_number, opens_label):
+    pending, pending_offset, quotes = None, 0, 0
+    for offset, line in enumerate(lines):
+        count = line.count('"')
+        if pending is None:
+            if count % 2 == 0 or not opens_label(line):
+                yield offset, line
+                continue
+            pending, pending_offset, quotes = [line], offset, count
+            continue
+        pending.append(line)
+        quotes += count
+        if quotes % 2 == 0:
+            yield pending_offset, "\n".join(pending)
+            pending = None
+    if pending is not None:
+        raise MermaidSyntaxError("quoted label is never closed", first_line_number + pending_offset + 1)
+
+# Split the code into its preamble (optional front matter, then %% directives and comments), the header line and
+# the body lines
+def _split_header(code):
+    lines = code.splitlines()
+    preamble = []
+    i = 0
+    if lines and lines[0].strip() == "---":
+        end = next((j for j in range(1, len(lines)) if lines[j].strip() == "---"), None)
+        if end is None:
+            raise MermaidSyntaxError("front matter is not closed", 1)
+        preamble = [line.strip() for line in lines[:end + 1]]
+        i = end + 1
+    while i < len(lines) and (not lines[i].strip() or lines[i].strip().startswith("%%")):
+        if lines[i].strip():
+            preamble.append(lines[i].strip())
+        i += 1
+    if i == len(lines):
+        raise MermaidSyntaxError("no diagram found")
+    return preamble, lines[i].strip(), i + 1, lines[i + 1:]
+
+def _normalize_mindmap_node(node, line_number):
+    match = _MINDMAP_NODE_RE.match(node)
+    if match is None:
+        return f"({quote_text(node)})" if re.search(r'[()\[\]{}"]', node) else node
+    node_id, opener = match.groups()
+    closer = MINDMAP_SHAPES[opener]
+    body = node[match.end():]
+    if body.endswith(closer):
+        body = body[:-len(closer)]
+    else:
+        # Repair a node the model forgot to close, or closed with the wrong delimiter
+        body = body.rstrip(")]}(")
+    if not body.strip():
+        raise MermaidSyntaxError("empty node", line_number)
+    return f"{node_id}{opener}{quote_text(body)}{closer}"
+
+# Split a normalized mindmap node into its shape delimiters and unquoted label, dropping the id.
+# A bare node such as Intro has no delimiters.
+def split_mindmap_node(node):
+    node = node.strip()
+    match = _MINDMAP_NODE_RE.match(node)
+    if match is None:
+        return "", node.strip('"'), ""
+    opener = match.group(2)
+    closer = MINDMAP_SHAPES[opener]
+    label = node[match.end():]
+    if label.endswith(closer):
+        label = label[:-len(closer)]
+    label = label.strip()
+    if len(label) >= 2 and label[0] == label[-1] == '"':
+        label = label[1:-1]
+    return opener, label, closer
+
+# Normalize indentation to one level per depth and quote every node; there must be exactly one root
+def normalize_mindmap(lines, first_line_number):
+    output = ["mindmap"]
+    stack = []
+    level = 0
+    for offset, line in _logical_lines(lines, first_line_number, _MINDMAP_QUOTED_LABEL_RE.match):
+        line_number = first_line_number + offset + 1
+        stripped = line.strip()
+        if not stripped:
+            continue
+        # A multi-line label is one quoted string ending its own node; anything else is a stray quote that
+        # swallowed the nodes below it
+        if "\n" in stripped and (stripped.count('"') != 2 or not _MINDMAP_LABEL_END_RE.search(stripped)):
+            raise MermaidSyntaxError("quoted label runs past the end of its node", line_number)
+        # Icons, classes and comments decorate the node above them
+        if stripped.startswith(("::", "%%")):
+            if not stack:
+                raise MermaidSyntaxError("decoration before the root node", line_number)
+            output.append(INDENT * (level + 2) + stripped)
+            continue
+        indent = _indent_width(line)
+        while stack and indent <= stack[-1]:
+            stack.pop()
+        level = len(stack)
+        if level == 0 and len(output) > 1:
+            raise MermaidSyntaxError("a mindmap can only have one root node", line_number)
+        stack.append(indent)
+        output.append(INDENT * (level + 1) + _normalize_mindmap_node(stripped, line_number))
+    if len(output) == 1:
+        raise MermaidSyntaxError("mindmap has no nodes")
+    return output
+
+# Find where a label that opened at start ends, skipping over quoted text
+def _find_closer(line, start, closers, line_number):
+    i = start
+    while True:
+        found = [(line.find(closer, i), closer) for closer in closers]
+        found = [(position, closer) for position, closer in found if position != -1]
+        if not found:
+            raise MermaidSyntaxError(f"unclosed node label starting at column {start}", line_number)
+        position, closer = min(found)
+        quote = line.find('"', i, position)
+        if quote == -1:
+            return position, closer
+        end_quote = line.find('"', quote + 1)
+        if end_quote == -1:
+            raise MermaidSyntaxError("unbalanced double quotes", line_number)
+        i = end_quote + 1
+
+# Scan one flowchart statement, quoting node labels and renaming nodes that use the reserved id "end"
+def _normalize_flowchart_statement(line, line_number):
+    output = []
+    segment_start = 0
+    i = 0
+
+    def flush(stop):
+        output.append(_END_ID_RE.sub("End", line[segment_start:stop]))
+
+    # Jump from one character that matters to the next; everything in between is copied as is
+    while True:
+        match = _FLOWCHART_SPECIAL_RE.search(line, i)
+        if match is None:
+            break
+        i = match.start()
+        char = line[i]
+        if char == '"':
+            end = line.find('"', i + 1)
+            if end == -1:
+                raise MermaidSyntaxError("unbalanced double quotes", line_number)
+            i = end + 1
+            continue
+        if char == "|":
+            # Edge label: copy it through untouched
+            end = line.find("|", i + 1)
+            if end == -1:
+                raise MermaidSyntaxError("unclosed edge label", line_number)
+            flush(i)
+            output.append(line[i:end + 1])
+            i = segment_start = end + 1
+            continue
+        if char in ")]}":
+            raise MermaidSyntaxError(f"unexpected {char!r} at column {i}", line_number)
+        if char == ">" and (i == 0 or line[i - 1] == "-" or not _ID_CHAR_RE.match(line[i - 1])):
+            # Arrow head, not an asymmetric node
+            i += 1
+            continue
+        opener, closers = next((shape for shape in FLOWCHART_SHAPES if line.startswith(shape[0], i)))
+        close_at, closer = _find_closer(line, i + len(opener), closers, line_number)
+        flush(i)
+        label = line[i + len(opener):close_at]
+        output.append(opener + (quote_text(label) if label.strip() else "") + closer)
+        i = segment_start = close_at + len(closer)
+    flush(len(line))
+    return "".join(output)
+
+# Normalize indentation by subgraph depth, quote labels and check every subgraph is closed
+def normalize_flowchart(header, lines, first_line_number):
+    output = [" ".join(header.split())]
+    depth = 0
+    statements = 0
+    for offset, line in _logical_lines(lines, first_line_number, lambda line: True):
+        line_number = first_line_number + offset + 1
+        stripped = line.strip()
+        if not stripped:
+            continue
+        if stripped == "end":
+            if depth == 0:
+                raise MermaidSyntaxError("'end' without a matching subgraph", line_number)
+            depth -= 1
+            output.append(INDENT * (depth + 1) + "end")
+            continue
+        if stripped.startswith(_FLOWCHART_PASSTHROUGH):
+            output.append(INDENT * (depth + 1) + stripped)
+            continue
+        if stripped.startswith("subgraph ") or stripped == "subgraph":
+            output.append(INDENT * (depth + 1) + "subgraph " + _normalize_flowchart_statement(stripped[9:], line_number))
+            depth += 1
+            continue
+        output.append(INDENT * (depth + 1) + _normalize_flowchart_statement(stripped, line_number))
+        statements += 1
+    if depth:
+        raise MermaidSyntaxError(f"{depth} subgraph(s) not closed with 'end'")
+    if not statements:
+        raise MermaidSyntaxError("flowchart has no nodes")
+    return output
+
+# Extract, normalize and validate Mermaid code from a model response in a single pass over its lines
+def clean_mermaid_code(response):
+    code = extract_code(response.translate(QUOTE_TRANSLATION))
+    preamble, header, header_line_number, lines = _split_header(code)
+    keyword = header.split()[0]
+    if keyword not in DIAGRAM_HEADERS:
+        raise MermaidSyntaxError(f"unknown diagram type {keyword!r}", header_line_number)
+    if keyword == "mindmap":
+        body = normalize_mindmap(lines, header_line_number)
+    elif keyword in ("flowchart", "graph"):
+        body = normalize_flowchart(header, lines, header_line_number)
+    else:
+        body = [header] + [line.rstrip() for line in lines]
+    return "\n".join(preamble + body)
@@ -0,0 +1,211 @@
+import html
+import re
+from html.parser import HTMLParser
+
+# lxml parses in C and is used when it is installed; the standard library tokenizer is the fallback
+try:
+    from lxml import etree
+    import lxml.html
+except ImportError:
+    lxml = None
+
+# Elements whose text never belongs in a prompt: code, page chrome and widgets
+SKIP_TAGS = {
+    "script", "style", "noscript", "template", "svg", "canvas", "iframe", "object",
+    "nav", "footer", "aside", "form", "button", "select", "dialog",
+}
+# Page-level headers hold logos and menus; inside <main> or <article> they usually hold the title
+PAGE_SKIP_TAGS = SKIP_TAGS | {"header"}
+# Elements that end a paragraph of text
+BLOCK_TAGS = {
+    "p", "div", "section", "article", "main", "header", "h1", "h2", "h3", "h4", "h5", "h6",
+    "li", "dt", "dd", "ul", "ol", "dl", "table", "tr", "blockquote", "pre", "figure", "figcaption",
+    "hr", "br", "details", "summary", "address",
+}
+CELL_TAGS = {"td", "th"}
+# Without a <main> element, the longest <article> is taken as the content only if it clearly dominates: it holds
+# at least ARTICLE_PAGE_SHARE of the page's text and ARTICLE_ARTICLES_SHARE of the text of all articles, as on a
+# blog post. Listing pages, or pages whose content sits in <div>s next to an article-shaped card, are kept whole.
+ARTICLE_PAGE_SHARE = 0.5
+ARTICLE_ARTICLES_SHARE = 0.8
+
+_MAIN_RE = re.compile(rb"<main[\s>]", re.IGNORECASE)
+_CHARSET_RE = re.compile(rb"""<meta[^>]+charset=["']?([\w-]+)""", re.IGNORECASE)
+
+
+class _TextBuilder:
+    # Collects text from start/end/data events, skipping boilerplate and breaking paragraphs at block elements
+    def __init__(self, skip_tags):
+        self.skip_tags = skip_tags
+        self.skip_depth = 0
+        self.parts = []
+
+    def start(self, tag):
+        if tag in self.skip_tags:
+            self.skip_depth += 1
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n\n")
+
+    def end(self, tag):
+        if tag in self.skip_tags:
+            self.skip_depth = max(0, self.skip_depth - 1)
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n\n")
+        elif tag in CELL_TAGS:
+            self.parts.append(" | ")
+
+    def data(self, text):
+        if not self.skip_depth and text:
+            self.parts.append(text)
+
+    # Paragraphs separated by blank lines, with the whitespace inside each one collapsed
+    def text(self):
+        paragraphs = (" ".join(paragraph.split()) for paragraph in "".join(self.parts).split("\n\n"))
+        return "\n\n".join(paragraph.strip(" |") for paragraph in paragraphs if paragraph.strip(" |"))
+
+
+class _StreamingParser(HTMLParser):
+    # Standard library fallback. Text goes to builder, only from inside scope_tag when given; the text of each
+    # outermost <article> also goes to a builder of its own
+    def __init__(self, builder, scope_tag):
+        super().__init__(convert_charrefs=True)
+        self.builder = builder
+        self.scope_tag = scope_tag
+        self.scope_depth = 0 if scope_tag else 1
+        self.articles = []
+        self.article_depth = 0
+
+    def _builders(self):
+        builders = [self.builder] if self.scope_depth else []
+        if self.article_depth:
+            builders.append(self.articles[-1])
+        return builders
+
+    def handle_starttag(self, tag, attrs):
+        if tag == self.scope_tag:
+            self.scope_depth += 1
+        if tag == "article":
+            if not self.article_depth:
+                self.articles.append(_TextBuilder(SKIP_TAGS))
+            self.article_depth += 1
+        for builder in self._builders():
+            builder.start(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        if tag in BLOCK_TAGS:
+            for builder in self._builders():
+                builder.start(tag)
+
+    def handle_endtag(self, tag):
+        for builder in self._builders():
+            builder.end(tag)
+        if tag == self.scope_tag:
+            self.scope_depth -= 1
+        if tag == "article" and self.article_depth:
+            self.article_depth -= 1
+
+    def handle_data(self, data):
+        for builder in self._builders():
+            builder.data(data)
+
+# Decode a page using the charset declared in its first kilobytes, defaulting to UTF-8
+def _decode(page_content):
+    match = _CHARSET_RE.search(page_content[:4096])
+    try:
+        return page_content.decode(match.group(1).decode("ascii") if match else "utf-8", errors="replace")
+    except LookupError:
+        return page_content.decode("utf-8", errors="replace")
+
+# The longest of the outermost articles if it dominates the page, else the whole page
+def _choose_article(articles, page_text):
+    article = max(articles, key=len, default="")
+    if (
+        article
+        and len(article) >= ARTICLE_PAGE_SHARE * len(page_text)
+        and len(article) >= ARTICLE_ARTICLES_SHARE * sum(len(text) for text in articles)
+    ):
+        return article
+    return page_text
+
+def _lxml_element_text(element, skip_tags):
+    builder = _TextBuilder(skip_tags)
+    for event, node in etree.iterwalk(element, events=("start", "end")):
+        tag = node.tag if isinstance(node.tag, str) else None
+        if event == "start":
+            builder.start(tag)
+            builder.data(node.text if tag else None)
+        else:
+            builder.end(tag)
+            # The tail follows the element, outside the part of the tree being walked
+            if node is not element:
+                builder.data(node.tail)
+    return builder.text()
+
+def _lxml_text(page_content):
+    root = lxml.html.fromstring(page_content)
+    main = next(root.iter("main"), None)
+    if main is not None:
+        return _lxml_element_text(main, SKIP_TAGS)
+    articles = [
+        _lxml_element_text(article, SKIP_TAGS)
+        for article in root.iter("article")
+        if next(article.iterancestors("article"), None) is None
+    ]
+    return _choose_article(articles, _lxml_element_text(root, PAGE_SKIP_TAGS))
+
+def _stdlib_text(page_content):
+    scope_tag = "main" if _MAIN_RE.search(page_content) else None
+    builder = _TextBuilder(SKIP_TAGS if scope_tag else PAGE_SKIP_TAGS)
+    parser = _StreamingParser(builder, scope_tag)
+    parser.feed(_decode(page_content))
+    parser.close()
+    if scope_tag:
+        return builder.text()
+    return _choose_article([article.text() for article in parser.articles], builder.text())
+
+# Main-content text of an HTML page: scripts, styles, navigation and footers dropped, whitespace collapsed
+def html_to_text(page_content):
+    if isinstance(page_content, str):
+        page_content = page_content.encode("utf-8")
+    if not page_content.strip():
+        return ""
+    if lxml is not None:
+        return _lxml_text(page_content)
+    return _stdlib_text(page_content)
+
+_FENCE_RE = re.compile(r"^\s*(```|~~~)")
+_LINE_PREFIX_RE = re.compile(r"^\s*(?:#{1,6}\s+|>\s?|[-*+]\s+(?:\[[ xX]\]\s+)?|\d+[.)]\s+)+")
+_RULE_RE = re.compile(r"^\s*(?:[-*_]\s*){3,}$|^\s*\|?\s*:?-{3,}:?\s*(?:\|\s*:?-{3,}:?\s*)*\|?\s*$")
+_LINK_DEFINITION_RE = re.compile(r"^\s*\[[^\]]+\]:\s*\S+")
+_SETEXT_RE = re.compile(r"^\s*(=+|-+)\s*$")
+_INLINE_RULES = [
+    (re.compile(r"!\[([^\]]*)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"\[([^\]]+)\]\([^)]*\)"), r"\1"),
+    (re.compile(r"\[([^\]]+)\]\[[^\]]*\]"), r"\1"),
+    (re.compile(r"`([^`]+)`"), r"\1"),
+    (re.compile(r"(\*{1,3}|~~)(?=\S)(.+?)(?<=\S)\1"), r"\2"),
+    (re.compile(r"(?<!\w)(_{1,3})(?=\S)(.+?)(?<=\S)\1(?!\w)"), r"\2"),
+    (re.compile(r"<[^>\n]+>"), ""),
+]
+
+# Plain text of a markdown document, without rendering it to HTML first: markup is stripped line by line
+def markdown_to_text(markdown_content):
+    lines = []
+    in_code = False
+    for line in markdown_content.splitlines():
+        if _FENCE_RE.match(line):
+            in_code = not in_code
+            continue
+        if in_code:
+            lines.append(line.rstrip())
+            continue
+        if _RULE_RE.match(line) or _LINK_DEFINITION_RE.match(line) or (lines and lines[-1] and _SETEXT_RE.match(line)):
+            continue
+        line = _LINE_PREFIX_RE.sub("", line)
+        for pattern, replacement in _INLINE_RULES:
+            line = pattern.sub(replacement, line)
+        if "|" in line:
+            line = " | ".join(cell.strip() for cell in line.strip().strip("|").split("|"))
+        lines.append(" ".join(html.unescape(line).split()))
+    text = "\n".join(lines)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
@@ -0,0 +1,148 @@
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# When set, every finished trace is appended to this file as an OTLP/JSON export request
+TRACE_FILE_ENV = "MERMAID_TRACE_FILE"
+
+_current_tracer = contextvars.ContextVar("mermaid_tracer", default=None)
+_current_span = contextvars.ContextVar("mermaid_span", default=None)
+
+
+class Span:
+    # One timed stage of a conversion, with free-form attributes such as token counts and byte sizes
+    def __init__(self, name, trace_id, parent_id, attributes):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+        self.error = None
+        self._start = time.perf_counter()
+        self.duration = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def finish(self):
+        self.duration = time.perf_counter() - self._start
+        self.end_ns = self.start_ns + int(self.duration * 1e9)
+
+    def to_dict(self):
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "span": self.name,
+            "duration_ms": round(self.duration * 1000, 3) if self.duration is not None else None,
+        }
+        if self.error:
+            record["error"] = self.error
+        record.update(self.attributes)
+        return record
+
+
+class _NullSpan:
+    # Stand-in used when no trace is active, so instrumented code never has to check
+    def set(self, **attributes):
+        pass
+
+
+class Tracer:
+    # Collects the spans of one trace; spans may be opened from several threads
+    def __init__(self, export_path=None):
+        self.trace_id = os.urandom(16).hex()
+        self.export_path = export_path
+        self.spans = []
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def span(self, name, **attributes):
+        parent = _current_span.get()
+        span = Span(name, self.trace_id, parent.span_id if parent else None, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            span.finish()
+            with self._lock:
+                self.spans.append(span)
+            logger.info(json.dumps(span.to_dict(), default=str))
+
+    # Finished spans in start order, as plain dicts
+    def summary(self):
+        with self._lock:
+            spans = sorted(self.spans, key=lambda span: span.start_ns)
+        return [span.to_dict() for span in spans]
+
+    def export(self):
+        if self.export_path:
+            with self._lock:
+                spans = list(self.spans)
+            with open(self.export_path, "a", encoding="utf-8") as file:
+                file.write(json.dumps(to_otlp(spans)) + "\n")
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+# Convert spans to an OTLP/JSON ExportTraceServiceRequest, as read by OpenTelemetry collectors
+def to_otlp(spans, service_name="mermaid-diagrams"):
+    otlp_spans = []
+    for span in spans:
+        otlp_span = {
+            "traceId": span.trace_id,
+            "spanId": span.span_id,
+            "name": span.name,
+            "kind": 1,
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.end_ns),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in span.attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id:
+            otlp_span["parentSpanId"] = span.parent_id
+        otlp_spans.append(otlp_span)
+    return {
+        "resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": otlp_spans}],
+        }]
+    }
+
+# Start a trace for one conversion; spans opened anywhere below it, in this context, belong to it
+@contextlib.contextmanager
+def trace(name, export_path=None, **attributes):
+    tracer = Tracer(export_path or os.environ.get(TRACE_FILE_ENV))
+    token = _current_tracer.set(tracer)
+    try:
+        with tracer.span(name, **attributes):
+            yield tracer
+    finally:
+        _current_tracer.reset(token)
+        tracer.export()
+
+# Open a span in the active trace, or do nothing when there is none
+def span(name, **attributes):
+    tracer = _current_tracer.get()
+    if tracer is None:
+        return contextlib.nullcontext(_NullSpan())
+    return tracer.span(name, **attributes)
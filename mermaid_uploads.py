@@ -0,0 +1,99 @@
+import contextlib
+import os
+import shutil
+import threading
+import uuid
+
+from mermaid_pdf import pdf_worker_count
+
+# Uploaded files waiting to be converted
+UPLOAD_DIR = os.path.join(".mermaid_cache", "uploads")
+# Uploads are copied to disk in pieces of this size, so no second full copy is ever held in memory
+SPOOL_CHUNK_BYTES = 1024 * 1024
+
+# Largest accepted upload, and the memory that PDF extraction may use across every job of this process.
+# Keep MERMAID_MAX_UPLOAD_MB in line with server.maxUploadSize in .streamlit/config.toml.
+MAX_UPLOAD_BYTES = int(os.environ.get("MERMAID_MAX_UPLOAD_MB", "200")) * 1024 * 1024
+PDF_MEMORY_LIMIT_BYTES = int(os.environ.get("MERMAID_PDF_MEMORY_MB", "1024")) * 1024 * 1024
+# Working memory of one process extracting a PDF, as a multiple of the file size, plus a fixed overhead.
+# See benchmarks/profile_upload_memory.py for how these were measured.
+PDF_MEMORY_FACTOR = float(os.environ.get("MERMAID_PDF_MEMORY_FACTOR", "1.5"))
+PDF_MEMORY_OVERHEAD_BYTES = 64 * 1024 * 1024
+
+
+class UploadRejected(ValueError):
+    # An upload that can never be converted within the configured limits; the message is shown to the user
+    pass
+
+
+def _mb(size):
+    return f"{size / 1024 / 1024:,.0f} MB"
+
+# Estimated peak memory of one process extracting a PDF of size bytes
+def pdf_memory_estimate(size):
+    return int(size * PDF_MEMORY_FACTOR) + PDF_MEMORY_OVERHEAD_BYTES
+
+# Reject an upload that is too large to accept, or to ever extract within the memory limit
+def check_upload(size, name="The file"):
+    if size > MAX_UPLOAD_BYTES:
+        raise UploadRejected(f"{name} is {_mb(size)}; uploads are limited to {_mb(MAX_UPLOAD_BYTES)}.")
+    if pdf_memory_estimate(size) > PDF_MEMORY_LIMIT_BYTES:
+        raise UploadRejected(
+            f"{name} needs about {_mb(pdf_memory_estimate(size))} of memory to read, "
+            f"more than this server's limit of {_mb(PDF_MEMORY_LIMIT_BYTES)}."
+        )
+
+# Copy an uploaded file object to disk piece by piece and return its path; the name only supplies the extension
+def spool_upload(file, name):
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    path = os.path.join(UPLOAD_DIR, f"{uuid.uuid4().hex}{os.path.splitext(name)[1]}")
+    tmp_path = f"{path}.{threading.get_ident()}.tmp"
+    file.seek(0)
+    with open(tmp_path, "wb") as spooled:
+        shutil.copyfileobj(file, spooled, SPOOL_CHUNK_BYTES)
+    os.replace(tmp_path, path)
+    return path
+
+def remove_upload(path):
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(path)
+
+
+class MemoryBudget:
+    # Bytes of estimated working memory handed out to concurrent extractions, first come first served
+    def __init__(self, limit):
+        self.limit = limit
+        self.used = 0
+        self._condition = threading.Condition()
+
+    # Hold nbytes of the budget, waiting while others use it; on_wait is called once if there is a wait
+    @contextlib.contextmanager
+    def reserve(self, nbytes, on_wait=None):
+        nbytes = min(nbytes, self.limit)
+        with self._condition:
+            waiting = self.used + nbytes > self.limit
+        # Report outside the lock; the callback may be slow, e.g. a database write
+        if waiting and on_wait:
+            on_wait()
+        with self._condition:
+            self._condition.wait_for(lambda: self.used + nbytes <= self.limit)
+            self.used += nbytes
+        try:
+            yield
+        finally:
+            with self._condition:
+                self.used -= nbytes
+                self._condition.notify_all()
+
+
+_pdf_memory = MemoryBudget(PDF_MEMORY_LIMIT_BYTES)
+
+def get_pdf_memory_budget():
+    return _pdf_memory
+
+# Worker processes to extract a PDF of page_count pages with, and the memory to reserve for them: as many as
+# extract_pdf_pages would start and fit the limit, at least one
+def pdf_extraction_plan(size, page_count, max_workers=None):
+    per_process = pdf_memory_estimate(size)
+    workers = max(1, min(pdf_worker_count(page_count, max_workers), PDF_MEMORY_LIMIT_BYTES // per_process))
+    return workers, workers * per_process
@@ -1,111 +1,24 @@
-import requests
-import importlib.util
 import logging
-from langchain_openai import ChatOpenAI
-from langchain.prompts import PromptTemplate
-from bs4 import BeautifulSoup
-import markdown
 import streamlit as st
 import streamlit.components.v1 as components
-import pdfplumber
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from mermaid_jobs import DONE, FAILED, QUEUED, RUNNING, get_job_store, get_job_workers
+from mermaid_pipeline import DIAGRAM_TYPES, complete_prefix, get_result_cache
+from mermaid_render import mermaid_chart_html, render_diagram
+from mermaid_uploads import UploadRejected, check_upload, spool_upload
+
+# How often a page showing a queued or running job checks on it, in seconds
+JOB_POLL_SECONDS = 1.0
+
+# Scale of the high-resolution PNG export
+EXPORT_PNG_SCALE = 3
 
 # Logging
 logging.basicConfig(level=logging.INFO)
 
-# Function to scrape text from a URL
-def scrape_text(url):
-    response = requests.get(url)
-    if response.status_code == 200:
-        page_content = response.content
-        soup = BeautifulSoup(page_content, "html.parser")
-        text = soup.get_text()
-        return text
-    else:
-        return "Failed to scrape the website"
-
-# Function to load and process PDF
-def process_pdf(file_path):
-    with pdfplumber.open(file_path) as pdf:
-        text = ""
-        for page in pdf.pages:
-            text += page.extract_text()
-            tables = page.extract_tables()
-    return text
-
-# Function to load a markdown file
-def load_markdown_as_text(file_path):
-    with open(file_path, 'r', encoding='utf-8') as file:
-        markdown_content = file.read()
-    html_content = markdown.markdown(markdown_content)
-    soup = BeautifulSoup(html_content, 'html.parser')
-    text = soup.get_text()
-    return text
-
-# Load content
-def load_content(source, source_type):
-    if source_type == 'pdf':
-        return process_pdf(source)
-    elif source_type == 'url':
-        return scrape_text(source)
-    elif source_type == 'markdown':
-        return load_markdown_as_text(source)
-    else:
-        raise ValueError("""
-            Invalid source type. 
-            Use "pdf" or "url".
-            """)
-
-# Function to generate Mermaid code
-def generate_mermaid_code(text, examples, api_key, model_name):
-    llm = ChatOpenAI(api_key=api_key, model_name=model_name)
-    prompt = PromptTemplate.from_template(template=prompt_template)
-    formatted_prompt = prompt.format(examples=examples, text=text)
-    response = llm(formatted_prompt)
-    return response
-
-# Load examples
-def load_examples(file_path):
-    spec = importlib.util.spec_from_file_location("mermaid_examples", file_path)
-    mermaid_examples_module = importlib.util.module_from_spec(spec)
-    spec.loader.exec_module(mermaid_examples_module)
-    return mermaid_examples_module.mermaid_examples
-
-# Define the prompt template
-prompt_template = """
-You are a helpful assistant that generates Mermaid code for diagrams. 
-Here are some examples of Mermaid diagrams:
-
-{examples}
-
-Based on the text below, perform the following steps.
-1. Identify the entire list of topics or ideas contained in the document
-2. Design a detailed mindmap of the document with all the topics identified
-3. Generate the corresponding Mermaid code.
-
-Text: {text}
-
-Provide only the Mermaid code. 
-
-Formatting rules:
-1. Use only ASCII-safe characters in your response.
-2. Enclose all text in a node between "". Here's an example: ("Text in a node")
-"""
-
-# Clean mermaid code
-def clean_mermaid_code(mermaid_code):
-    mermaid_code_cleaned = mermaid_code.content.strip('`').replace('mermaid', '').strip()
-    mermaid_code_cleaned = mermaid_code_cleaned.replace(u"\u2018", "'").replace(u"\u2019", "'")
-    mermaid_code_cleaned = mermaid_code_cleaned.replace("end", "End")
-    return mermaid_code_cleaned
-
-def mermaid_chart_html(mermaid_code_content):
-    html_code = f"""
-    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/5.15.1/css/all.min.css">
-    <div class="mermaid" id="mermaid-chart">{mermaid_code_content}</div>
-    <script src="https://cdn.jsdelivr.net/npm/mermaid/dist/mermaid.min.js"></script>
-    <script>mermaid.initialize({{startOnLoad:true}});</script>
-    """
-    return html_code
+# Start this process's job workers on any page view, so jobs queued or interrupted before a restart are picked up
+# even when nobody submits a new one
+job_workers = get_job_workers()
 
 # Streamlit app
 st.set_page_config(
@@ -116,12 +29,144 @@ st.set_page_config(
 # Sidebar for OpenAI API key and model selection
 st.sidebar.title("AI Diagram Generator")
 st.sidebar.image("./media/mermaid.png")
-st.sidebar.markdown("Use this tool to easily convert a webpage or PDF document into a mindmap!")
+st.sidebar.markdown("Use this tool to easily convert a webpage or PDF document into a mindmap, flowchart or other diagram!")
 
 api_key = st.sidebar.text_input("Enter your OpenAI API key:", type="password", placeholder="sk-********")
 help_text = st.sidebar.markdown("_Don't worry, your keys are not saved! Refresh the page to test it out._") 
 linebreak_text = st.sidebar.markdown(" ") 
-model_name = st.sidebar.selectbox("Select the OpenAI model name:", ["gpt-4o-mini", "gpt-4o"])
+model_name = st.sidebar.selectbox(
+    "Select the OpenAI model name:",
+    ["auto", "gpt-4o-mini", "gpt-4o"],
+    help="auto uses gpt-4o-mini, and gpt-4o for long documents or when gpt-4o-mini returns invalid Mermaid code",
+)
+stream_output = st.sidebar.checkbox("Show the diagram while it is generated", value=True)
+st.sidebar.text_input(
+    "Open a previous job by its id:",
+    key="open_job",
+    on_change=lambda: st.query_params.update(job=st.session_state.open_job.strip()),
+)
+
+# Report how many examples went into the prompt and the tokens this saved
+def show_examples_report(report, title="Mindmap"):
+    st.write(
+        f"Using {report['examples']} {title.lower()} examples "
+        f"({report['selected_tokens']} tokens, {report['saved_tokens']} fewer than sending every example)"
+    )
+
+# Expandable per-stage timing of a conversion; browser rendering time is shown under the diagram
+def show_timing_panel(spans):
+    depths = {}
+    rows = []
+    for record in spans:
+        depth = depths.get(record["parent_id"], -1) + 1
+        depths[record["span_id"]] = depth
+        details = {key: value for key, value in record.items() if key not in ("trace_id", "span_id", "parent_id", "span", "duration_ms")}
+        rows.append({
+            "Stage": "\u2003" * depth + record["span"],
+            "Time (ms)": record["duration_ms"],
+            "Details": ", ".join(f"{key}={value}" for key, value in details.items()),
+        })
+    with st.expander("Timing breakdown"):
+        st.dataframe(rows, hide_index=True)
+
+# Show a queued or running job, with the partial diagram while tokens stream in; reruns the page once it finishes
+@st.fragment(run_every=JOB_POLL_SECONDS)
+def show_job_progress(job_id):
+    job = get_job_store().get(job_id)
+    if job is None or job["status"] in (DONE, FAILED):
+        st.rerun()
+    if job["status"] == QUEUED:
+        label = f"Queued: number {job['position']} in line"
+    else:
+        label = f"{job['progress']}..."
+    with st.status(label=label, state="running", expanded=True):
+        st.caption(f"Job {job_id}. You can close or reload this page and come back to the result later.")
+        if job["partial"]:
+            st.code(job["partial"], language="mermaid")
+            prefix = complete_prefix(job["partial"])
+            if prefix:
+                components.html(mermaid_chart_html(prefix), width=800, height=400, scrolling=True)
+
+# Show one diagram of a finished job with its downloads and the code to edit it
+def show_diagram(diagram):
+    if "error" in diagram:
+        st.error(diagram["error"])
+        return
+    cleaned_mermaid_code, svg = diagram["mermaid_code"], diagram["svg"]
+    show_examples_report(diagram["examples"], diagram["title"])
+    if svg is not None:
+        components.html(f'<div style="overflow: auto;">{svg}</div>', width=800, height=400, scrolling=True)
+    else:
+        components.html(mermaid_chart_html(cleaned_mermaid_code, show_render_time=True), width=800, height=400, scrolling=True)
+    st.markdown("## Download")
+    # on_click="ignore" keeps the diagram on screen instead of rerunning the script
+    file_stem = f"diagram-{diagram['type']}"
+    col1, col2, col3 = st.columns(3)
+    col1.download_button("Mermaid code", cleaned_mermaid_code, file_name=f"{file_stem}.mmd", mime="text/plain", on_click="ignore")
+    if svg is not None:
+        col2.download_button("SVG", svg, file_name=f"{file_stem}.svg", mime="image/svg+xml", on_click="ignore")
+        # Rendered only when clicked, then served from the render cache
+        col3.download_button(
+            "High-resolution PNG",
+            lambda: render_diagram(cleaned_mermaid_code, "png", scale=EXPORT_PNG_SCALE),
+            file_name=f"{file_stem}.png",
+            mime="image/png",
+            on_click="ignore",
+        )
+    else:
+        st.caption("Install the Mermaid CLI (mmdc) on the server to download SVG and PNG files.")
+    with st.expander("Generated Mermaid Code"):
+        st.markdown("#### Generated Mermaid Code")
+        st.code(cleaned_mermaid_code, language="mermaid")
+
+# Show the diagrams of a finished job, one tab per diagram type, with the reports and timing of the conversion
+def show_job_result(job):
+    result = job["result"]
+    if "compaction" in result:
+        st.write(
+            f"Compacted the text from {result['compaction']['tokens_before']:,} to "
+            f"{result['compaction']['tokens_after']:,} tokens"
+        )
+    if "incremental" in result:
+        st.write(
+            f"Reused {result['incremental']['reused']} of {result['incremental']['sections']} mindmap sections, "
+            f"regenerated {result['incremental']['generated']}"
+        )
+    st.markdown("## Mermaid Diagram")
+    diagrams = result["diagrams"]
+    if len(diagrams) == 1:
+        show_diagram(diagrams[0])
+    else:
+        for tab, diagram in zip(st.tabs([diagram["title"] for diagram in diagrams]), diagrams):
+            with tab:
+                show_diagram(diagram)
+    show_timing_panel(result["trace"])
+    st.markdown("## How do I edit the diagram")
+    st.markdown("Copy the code below and paste it into the Mermaid Live Editor")
+    st.link_button("Mermaid Live Editor", "https://mermaid.live", type="secondary")
+    st.image("./media/mermaid_live.jpeg", caption="How to use the Mermaid Live service")
+
+# Why an uploaded file cannot be converted, or None
+def upload_rejection(uploaded_file):
+    try:
+        check_upload(uploaded_file.size, uploaded_file.name)
+    except UploadRejected as e:
+        return str(e)
+    return None
+
+# Cache statistics
+cache_stats_container = st.sidebar.container()
+
+def show_cache_stats():
+    stats = get_result_cache().stats()
+    with cache_stats_container.expander("Result cache", expanded=False):
+        col1, col2 = st.columns(2)
+        col1.metric("Hits", stats["hits"])
+        col2.metric("Misses", stats["misses"])
+        st.caption(f"{stats['entries']} cached diagrams, {stats['bytes'] / 1024:.1f} KiB on disk")
+        if st.button("Clear cache"):
+            get_result_cache().clear()
+            st.rerun()
 
 # Main content
 tab1, tab2 = st.tabs(["📈 Diagram Generator", "Sample Output"])
@@ -131,14 +176,45 @@ with tab1:
 
     # User input for source type
     source_type = st.selectbox("Select source (URL or PDF):", ["url", "pdf"])
+    diagram_types = st.multiselect(
+        "Diagram types:",
+        list(DIAGRAM_TYPES),
+        default=["mindmap"],
+        format_func=lambda diagram_type: DIAGRAM_TYPES[diagram_type]["title"],
+        help="The source is read once and every diagram type is generated at the same time.",
+    )
 
     # User input for source based on source type
     if source_type == "pdf":
         uploaded_file = st.file_uploader("Upload a PDF file", type="pdf")
         if uploaded_file is not None:
             source = uploaded_file
+        include_tables = st.checkbox("Include tables from the PDF", value=False)
+        stream_pages = st.checkbox(
+            "Stream pages into generation",
+            value=False,
+            help="Start generating as soon as the first pages are read instead of waiting for the whole file. Mindmaps only.",
+        )
     else:
         source = st.text_input("Enter the URL:")
+    incremental = st.checkbox(
+        "Only regenerate changed sections",
+        value=False,
+        help="Reuse the branches of the last mindmap made from this URL, or from a file of the same name uploaded in this session, and regenerate only the sections that changed.",
+    )
+    compact = st.checkbox(
+        "Compact text before prompting",
+        value=True,
+        help="Remove repeated page headers, footers, page numbers and duplicate paragraphs.",
+    )
+    token_budget = st.number_input(
+        "Token budget (0 for no limit)",
+        min_value=0,
+        value=0,
+        step=1000,
+        disabled=not compact,
+        help="Keep the most informative sentences, and every heading, within this many tokens.",
+    )
 
     if st.button("Generate Mermaid Diagram"):
         if not api_key:
@@ -147,35 +223,51 @@ with tab1:
             st.error("Please upload a PDF file.")
         elif source_type == "url" and not source:
             st.error("Please enter a URL.")
+        elif not diagram_types:
+            st.error("Please choose at least one diagram type.")
+        elif source_type == "pdf" and (rejection := upload_rejection(uploaded_file)):
+            st.error(rejection)
         else:
+            params = {
+                "source_type": source_type,
+                "model_name": model_name,
+                "diagram_types": diagram_types,
+                "stream_output": stream_output,
+                "incremental": incremental,
+                "compact": compact,
+                "token_budget": token_budget,
+                # LLM slots are shared fairly between sessions
+                "session_id": get_script_run_ctx().session_id,
+            }
             if source_type == "pdf":
-                text = process_pdf(source)
+                params.update(
+                    upload=spool_upload(uploaded_file, uploaded_file.name),
+                    source_name=uploaded_file.name,
+                    include_tables=include_tables,
+                    stream_pages=stream_pages,
+                )
             else:
-                text = scrape_text(source)
-            
-            mermaid_examples = load_examples("mermaid_examples.py")
-
-            # Generate Mermaid code
-            with st.status(label="Generating Mermaid code...", expanded=True) as status:
-                mermaid_code = generate_mermaid_code(text, mermaid_examples, api_key, model_name)
-                st.write("Generating Mermaid code...")
-                # Clean the Mermaid code
-                cleaned_mermaid_code = clean_mermaid_code(mermaid_code)
-                st.write("Cleaning Mermaid code...")
-                st.write("Rendering Mermaid diagram...")
-                status.update(label="Done!", state="complete", expanded=False)
-                mermaid_html = mermaid_chart_html(cleaned_mermaid_code)
-                
-            st.markdown("## Mermaid Diagram")
-            components.html(mermaid_html, width=800, height=400, scrolling=True)
-            st.markdown("## How do I edit and/or save in a higher resolution")
-            st.markdown("Copy the code below and paste it into the Mermaid Live Editor")
-            st.link_button("Mermaid Live Editor", "https://mermaid.live", type="secondary")
-            with st.expander("Generated Mermaid Code"):
-                st.markdown("#### Generated Mermaid Code")
-                st.code(cleaned_mermaid_code, language="mermaid")
-            st.image("./media/mermaid_live.jpeg", caption="How to use the Mermaid Live service")
-                
+                params.update(source=source, source_name=source)
+            # The job id in the address survives reloads and can be bookmarked
+            st.query_params["job"] = job_workers.submit(params, api_key)
+
+    job_id = st.query_params.get("job")
+    if job_id:
+        job = get_job_store().get(job_id)
+        if job is None:
+            st.error(f"There is no job {job_id}; finished jobs are kept for a week.")
+        elif job["status"] in (QUEUED, RUNNING):
+            show_job_progress(job_id)
+        elif job["status"] == FAILED:
+            st.error(job["error"])
+            if job["result"]:
+                show_timing_panel(job["result"]["trace"])
+        else:
+            show_job_result(job)
+
+# Rendered last so the counters include this run's hit or miss
+show_cache_stats()
+
 with tab2:
     st.markdown("# Sample Output")
     st.markdown("Source: https://apoorv03.com/p/the-economics-of-generative-ai")
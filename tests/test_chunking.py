@@ -0,0 +1,37 @@
+from mermaid_chunking import merge_mindmaps, node_label, root_as_node
+from mermaid_syntax import clean_mermaid_code
+
+
+def test_root_as_node_keeps_shape_and_drops_id():
+    assert root_as_node('root(("Title"))') == '(("Title"))'
+    assert root_as_node('A(("Intro"))') == '(("Intro"))'
+    assert root_as_node('intro["Intro"]') == '["Intro"]'
+    assert root_as_node("Plain") == '("Plain")'
+
+def test_node_label_ignores_any_id():
+    assert node_label('root("Title")') == "Title"
+    assert node_label('A(("Intro"))') == "Intro"
+    assert node_label("Plain") == "Plain"
+    assert node_label('root("")') == "Document"
+
+# Chunk mindmaps whose roots are not called root still merge into valid code
+def test_merge_mindmaps_with_other_root_ids():
+    chunks = [
+        clean_mermaid_code("mindmap\n  A((Intro))\n    x"),
+        clean_mermaid_code("mindmap\n  root[Body]\n    y"),
+        clean_mermaid_code("mindmap\n  Plain\n    z"),
+    ]
+    merged = merge_mindmaps(chunks)
+    assert merged.splitlines()[:3] == ["mindmap", '    root("Intro")', '        (("Intro"))']
+    assert '        ["Body"]' in merged.splitlines()
+    assert '        ("Plain")' in merged.splitlines()
+    assert clean_mermaid_code(merged) == merged
+
+def test_merge_mindmaps_with_root_label():
+    merged = merge_mindmaps([clean_mermaid_code("mindmap\n  root((Part))\n    x")], root_label="Report")
+    assert merged.splitlines()[1] == '    root("Report")'
+
+def test_merge_skips_directives_of_sections():
+    first = clean_mermaid_code('%%{init: {"theme": "dark"}}%%\nmindmap\n  root((Intro))\n    A')
+    merged = merge_mindmaps([first, "mindmap\n  root(Results)\n    B"])
+    assert merged.splitlines()[:3] == ["mindmap", '    root("Intro")', '        (("Intro"))']
@@ -0,0 +1,54 @@
+from mermaid_compaction import compact_text, iter_compacted_pages, page_paragraphs
+
+PAGE = """1 Introduction
+This report describes the results of the company over the last year and the plans for the
+next one, including the budget for every department and the people responsible for it.
+2 Results
+Revenue grew by ten percent compared with the previous year, driven mostly by new customers
+in the northern region and by higher prices for the largest products sold in the period."""
+TABLE = "Region | Revenue\nNorth | 10\nSouth | 5"
+
+
+def test_page_is_reflowed_next_to_a_table():
+    paragraphs = page_paragraphs(PAGE + "\n\n" + TABLE)
+    assert paragraphs[0] == "1 Introduction"
+    assert paragraphs[1].startswith("This report describes") and paragraphs[1].endswith("responsible for it.")
+    assert paragraphs[2] == "2 Results"
+    assert paragraphs[-1] == TABLE
+
+# With tables on, every page has a blank line; headings must still be found and kept within the budget
+def test_budget_keeps_headings_of_pages_with_tables():
+    pages = [PAGE + "\n\n" + TABLE, PAGE.replace("Results", "Outlook") + "\n\n" + TABLE]
+    text, report = compact_text(pages, "gpt-4o-mini", token_budget=40)
+    for heading in ("1 Introduction", "2 Results", "2 Outlook"):
+        assert heading in text.split("\n\n")
+    assert report["dropped_sentences"] > 0
+
+# Paragraphs that differ only in their figures are different facts, not duplicates
+def test_paragraphs_differing_in_numbers_are_kept():
+    short = [f"Revenue in {year} was {amount} million dollars." for year, amount in ((2022, 10), (2023, 12), (2024, 15))]
+    long = [
+        f"In {year} the company opened {count} new stores in the northern region and hired staff for each of them, "
+        "which raised costs but also brought in many new customers over the rest of the year."
+        for year, count in ((2022, 4), (2023, 7))
+    ]
+    text, report = compact_text(["\n\n".join(short + long)], "gpt-4o-mini")
+    for paragraph in short + long:
+        assert paragraph in text
+    assert report["duplicate_paragraphs"] == 0
+
+def test_repeated_paragraph_is_dropped():
+    paragraph = "This report describes the results of the company over the last year and the plans for the next one."
+    text, report = compact_text(["\n\n".join([paragraph, "Other text follows here.", paragraph])], "gpt-4o-mini")
+    assert text.count(paragraph) == 1
+    assert report["duplicate_paragraphs"] == 1
+
+# Streamed pages are compacted in batches that share the budget; the report totals every batch
+def test_streamed_pages_share_the_budget():
+    pages = [PAGE.replace("Results", f"Results {number}") for number in range(1, 11)]
+    report = {}
+    texts = list(iter_compacted_pages(((len(pages), page) for page in pages), "gpt-4o-mini", 200, report, batch_pages=4))
+    assert len(texts) == 3
+    assert report["tokens_before"] > 900
+    assert report["tokens_after"] <= 200 + 3 * 20
+    assert report["dropped_sentences"] > 0
@@ -0,0 +1,133 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import mermaid_pipeline
+import mermaid_routing
+from mermaid_cache import ResultCache
+from mermaid_concurrency import FairLimiter, LeaderFailed, SingleFlight
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.005)
+
+
+# A session's n-th queued call goes behind every other session's earlier calls
+def test_fair_limiter_interleaves_sessions():
+    limiter = FairLimiter(1)
+    limiter.acquire("holder")
+    admitted = []
+
+    def call(session_id):
+        limiter.acquire(session_id)
+        admitted.append(session_id)
+        limiter.release(session_id)
+
+    threads = []
+    for session_id in ["big", "big", "big", "small"]:
+        thread = threading.Thread(target=call, args=(session_id,))
+        thread.start()
+        threads.append(thread)
+        wait_until(lambda: len(limiter._waiting) == len(threads))
+    limiter.release("holder")
+    for thread in threads:
+        thread.join()
+    assert admitted == ["big", "small", "big", "big"]
+    assert limiter.active == 0 and not limiter._outstanding
+
+def test_fair_limiter_reports_queue_position():
+    limiter = FairLimiter(1)
+    limiter.acquire("holder")
+    positions = []
+    thread = threading.Thread(target=lambda: limiter.acquire("waiting", positions.append))
+    thread.start()
+    wait_until(lambda: positions)
+    limiter.release("holder")
+    thread.join()
+    assert positions == [1, 0]
+    assert limiter.try_acquire("spare") is False
+    limiter.release("waiting")
+    assert limiter.try_acquire("spare") is True
+
+def test_single_flight_shares_one_result():
+    flight = SingleFlight()
+    started, finish = threading.Event(), threading.Event()
+    calls = []
+
+    def work():
+        calls.append(1)
+        started.set()
+        finish.wait()
+        return "result"
+
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        leader = executor.submit(flight.do, "key", work)
+        started.wait()
+        waiters = [executor.submit(flight.do, "key", work) for _ in range(2)]
+        time.sleep(0.05)
+        finish.set()
+        assert leader.result() == ("result", False)
+        assert [waiter.result() for waiter in waiters] == [("result", True)] * 2
+    assert len(calls) == 1
+
+# The leader's error stays with the leader; waiters run the work themselves
+def test_single_flight_does_not_share_the_leaders_error():
+    flight = SingleFlight()
+    future, leader = flight.claim("key")
+    assert leader
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        waiter = executor.submit(flight.do, "key", lambda: "own result")
+        time.sleep(0.05)
+        flight.fail("key")
+        assert waiter.result() == ("own result", False)
+    with pytest.raises(LeaderFailed):
+        future.result()
+
+def test_single_flight_leader_raises_its_own_error():
+    flight = SingleFlight()
+
+    def fail():
+        raise ValueError("bad key")
+
+    with pytest.raises(ValueError, match="bad key"):
+        flight.do("key", fail)
+    assert flight.do("key", lambda: "retried") == ("retried", False)
+
+
+class Response:
+    def __init__(self, content):
+        self.content = content
+
+
+class KeyedLLM:
+    # Fails for the "bad" API key, after long enough for another session to coalesce with it
+    def __init__(self, api_key):
+        self.api_key = api_key
+        self.model_name = "fake-model"
+
+    def invoke(self, prompt):
+        time.sleep(0.1)
+        if self.api_key == "bad":
+            raise PermissionError("invalid API key")
+        return Response('mindmap\n  root(("Doc"))\n    A')
+
+# A session with a valid key coalesced with one whose key is rejected still gets its diagram
+def test_coalesced_session_does_not_inherit_auth_failure(monkeypatch, tmp_path):
+    monkeypatch.setattr(mermaid_pipeline, "_result_cache", ResultCache(str(tmp_path / "results.sqlite3")))
+    monkeypatch.setattr(mermaid_routing, "get_llm", lambda api_key, model_name: KeyedLLM(api_key))
+
+    def generate(api_key):
+        return mermaid_pipeline.generate_mermaid_code_cached("Some text", "", api_key, "fake-model")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        bad = executor.submit(generate, "bad")
+        time.sleep(0.02)
+        good = executor.submit(generate, "good")
+        with pytest.raises(PermissionError):
+            bad.result()
+        assert good.result().startswith("mindmap")
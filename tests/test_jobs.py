@@ -0,0 +1,31 @@
+import pytest
+import requests
+
+import mermaid_pipeline
+from mermaid_jobs import JobError, JobStore, JobWorkers, run_conversion
+
+
+# A worker may claim a job the moment its row is committed, so the API key must already be registered
+def test_api_key_is_registered_before_the_job_is_queued(tmp_path):
+    store = JobStore(str(tmp_path / "jobs.sqlite3"))
+    workers = JobWorkers(store)
+    keys_at_insert = []
+    submit = store.submit
+
+    def checking_submit(params, job_id=None):
+        keys_at_insert.append(workers._api_keys.get(job_id))
+        return submit(params, job_id)
+
+    store.submit = checking_submit
+    job_id = workers.submit({"source_type": "url"}, "sk-user")
+    assert keys_at_insert == ["sk-user"]
+    assert store.claim("worker")["id"] == job_id
+
+def test_unreachable_url_fails_the_job(monkeypatch):
+    def fetch_url(url):
+        raise requests.ConnectionError("connection refused")
+
+    monkeypatch.setattr(mermaid_pipeline, "fetch_url", fetch_url)
+    params = {"source_type": "url", "source": "http://unreachable.invalid", "model_name": "gpt-4o-mini"}
+    with pytest.raises(JobError, match="Could not fetch http://unreachable.invalid"):
+        run_conversion(params, "sk-user", lambda message=None, partial=None: None)
@@ -0,0 +1,123 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import mermaid_concurrency
+import mermaid_routing
+from mermaid_batch import RateLimiter
+from mermaid_concurrency import FairLimiter
+from mermaid_tracing import span, trace
+
+
+class Response:
+    def __init__(self, content):
+        self.content = content
+
+
+class SlowLLM:
+    # Counts requests in flight; every request is slow enough to be hedged
+    model_name = "slow-model"
+
+    def __init__(self, seconds=0.1):
+        self.seconds = seconds
+        self.in_flight = 0
+        self.peak = 0
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def _enter(self):
+        with self._lock:
+            self.calls += 1
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+
+    def _exit(self):
+        with self._lock:
+            self.in_flight -= 1
+
+    def invoke(self, prompt):
+        self._enter()
+        try:
+            time.sleep(self.seconds)
+            return Response(prompt)
+        finally:
+            self._exit()
+
+    async def ainvoke(self, prompt):
+        self._enter()
+        try:
+            await asyncio.sleep(self.seconds)
+            return Response(prompt)
+        finally:
+            self._exit()
+
+
+@pytest.fixture
+def hedge_quickly(monkeypatch):
+    monkeypatch.setattr(mermaid_routing, "HEDGE_AFTER_SECONDS", "0.01")
+
+
+def test_route_auto_escalates():
+    assert mermaid_routing.route("auto", 10) == (mermaid_routing.FAST_MODEL, mermaid_routing.STRONG_MODEL)
+    assert mermaid_routing.route("auto", mermaid_routing.ROUTE_PROMPT_TOKENS + 1) == (
+        mermaid_routing.STRONG_MODEL, mermaid_routing.STRONG_MODEL
+    )
+    assert mermaid_routing.route("gpt-4o", 10) == ("gpt-4o", "gpt-4o")
+
+# Hedge requests take a spare slot and hold it until they finish, so the shared cap is never exceeded
+def test_sync_hedges_stay_within_the_llm_slots(monkeypatch, hedge_quickly):
+    limiter = FairLimiter(2)
+    monkeypatch.setattr(mermaid_concurrency, "_llm_limiter", limiter)
+    llm = SlowLLM()
+
+    def call(number):
+        with span("llm.invoke") as s:
+            return mermaid_routing.invoke_hedged(llm, f"prompt {number}", s).content
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        assert list(executor.map(call, range(8))) == [f"prompt {number}" for number in range(8)]
+    # Let any losing request finish
+    time.sleep(0.2)
+    assert llm.peak <= 2
+    assert limiter.active == 0
+
+def test_sync_hedge_is_started_when_a_slot_is_free(monkeypatch, hedge_quickly):
+    monkeypatch.setattr(mermaid_concurrency, "_llm_limiter", FairLimiter(2))
+    llm = SlowLLM()
+    with trace("test"), span("llm.invoke") as s:
+        mermaid_routing.invoke_hedged(llm, "prompt", s)
+    assert s.attributes["hedged"] is True
+    time.sleep(0.2)
+    assert llm.calls == 2
+
+# Every request, the hedge included, holds its own permit of the batch limiter
+def test_async_hedges_stay_within_the_batch_limiter(hedge_quickly):
+    llm = SlowLLM()
+
+    async def run():
+        limiter = RateLimiter(2)
+        with span("llm.invoke") as s:
+            return await asyncio.gather(*(
+                mermaid_routing.ainvoke_hedged(llm, f"prompt {number}", s, limiter) for number in range(4)
+            ))
+
+    assert [response.content for response in asyncio.run(run())] == [f"prompt {number}" for number in range(4)]
+    assert llm.peak <= 2
+
+# A permit taken while spacing out requests is given back when the waiting request is cancelled
+def test_rate_limiter_releases_permit_on_cancel():
+    async def run():
+        limiter = RateLimiter(1, requests_per_minute=60)
+        async with limiter:
+            pass
+        waiting = asyncio.ensure_future(limiter.__aenter__())
+        await asyncio.sleep(0.01)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        return limiter._semaphore.locked()
+
+    assert asyncio.run(run()) is False
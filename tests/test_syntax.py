@@ -0,0 +1,69 @@
+import time
+
+import pytest
+
+from mermaid_syntax import MermaidSyntaxError, clean_mermaid_code, split_mindmap_node
+
+
+def mindmap(*nodes):
+    return "\n".join(["mindmap", "  root((Root))"] + [f"    {node}" for node in nodes])
+
+
+def test_mindmap_is_quoted_and_reindented():
+    code = "```mermaid\nmindmap\n  root((Root))\n      A[First]\n        B(Second)\n```"
+    assert clean_mermaid_code(code) == 'mindmap\n    root(("Root"))\n        A["First"]\n            B("Second")'
+
+def test_mindmap_with_two_roots_is_rejected():
+    with pytest.raises(MermaidSyntaxError, match="one root"):
+        clean_mermaid_code("mindmap\n  root((One))\n  other((Two))")
+
+def test_multi_line_label_is_kept():
+    code = clean_mermaid_code(mindmap('A["first', '    second"]', "B[next]"))
+    assert code.splitlines()[2:] == ['        A["first', '        second"]', '        B["next"]']
+
+# A stray quote inside an unquoted label only affects its own node
+def test_stray_quote_in_unquoted_label_is_repaired():
+    code = clean_mermaid_code(mindmap('A[He said "hi]', "B[next]"))
+    assert code.splitlines()[2:] == ['        A["He said \'hi"]', '        B["next"]']
+
+def test_unclosed_quoted_label_is_rejected():
+    with pytest.raises(MermaidSyntaxError, match="line 3: quoted label is never closed"):
+        clean_mermaid_code(mindmap('A["stray]', "B[one]", "C[two]"))
+
+# Another stray quote further down must not turn every node in between into one label
+def test_quoted_label_running_past_its_node_is_rejected():
+    with pytest.raises(MermaidSyntaxError, match="runs past the end of its node"):
+        clean_mermaid_code(mindmap('A["stray]', 'B["quoted"]', 'C[x"]', "D[d]"))
+
+def test_stray_quote_in_large_mindmap_fails_fast():
+    nodes = [f"n{i}[Node {i}]" for i in range(40000)]
+    nodes[1] = 'A["stray]'
+    start = time.perf_counter()
+    with pytest.raises(MermaidSyntaxError):
+        clean_mermaid_code(mindmap(*nodes))
+    assert time.perf_counter() - start < 1.0
+
+def test_flowchart_labels_and_end_ids():
+    code = clean_mermaid_code("flowchart TD\n  A[Start] -->|go| end(Finish)")
+    assert code == 'flowchart TD\n    A["Start"] -->|go| End("Finish")'
+
+def test_flowchart_unclosed_subgraph_is_rejected():
+    with pytest.raises(MermaidSyntaxError, match="not closed"):
+        clean_mermaid_code("flowchart TD\n  subgraph one\n    A --> B")
+
+def test_flowchart_unclosed_quote_is_rejected():
+    with pytest.raises(MermaidSyntaxError, match="never closed"):
+        clean_mermaid_code('flowchart TD\n  A["oops] --> B\n  B --> C')
+
+def test_unknown_diagram_type_is_rejected():
+    with pytest.raises(MermaidSyntaxError, match="unknown diagram type"):
+        clean_mermaid_code("notADiagram\n  A")
+
+def test_split_mindmap_node():
+    assert split_mindmap_node('A(("Intro"))') == ("((", "Intro", "))")
+    assert split_mindmap_node('root["Title"]') == ("[", "Title", "]")
+    assert split_mindmap_node("Plain") == ("", "Plain", "")
+
+def test_directives_before_the_header_are_kept():
+    code = clean_mermaid_code('---\ntitle: Report\n---\n%%{init: {"theme": "dark"}}%%\n\nflowchart TD\n  A --> B')
+    assert code.splitlines() == ["---", "title: Report", "---", '%%{init: {"theme": "dark"}}%%', "flowchart TD", "    A --> B"]
@@ -0,0 +1,43 @@
+import pytest
+
+import mermaid_text
+from mermaid_text import html_to_text, markdown_to_text
+
+
+@pytest.fixture(params=["lxml", "stdlib"])
+def to_text(request, monkeypatch):
+    if request.param == "stdlib":
+        monkeypatch.setattr(mermaid_text, "lxml", None)
+    elif mermaid_text.lxml is None:
+        pytest.skip("lxml is not installed")
+    return html_to_text
+
+
+def page(body):
+    return f"<html><head><script>var x;</script></head><body>{body}</body></html>".encode("utf-8")
+
+
+def test_main_element_is_the_content(to_text):
+    html = page("<nav>Menu</nav><div>Sidebar</div><main><header>Title</header><p>Body</p></main>after")
+    assert to_text(html) == "Title\n\nBody"
+
+def test_boilerplate_is_dropped(to_text):
+    html = page("<header>Logo</header><nav>Menu</nav><p>One <b>two</b></p><footer>Legal</footer>")
+    assert to_text(html) == "One two"
+
+# A lone article-shaped card must not replace content that sits in <div>s
+def test_small_article_does_not_replace_the_page(to_text):
+    assert to_text(page("<div>Real content</div><article>Sponsored</article>")) == "Real content\n\nSponsored"
+
+def test_listing_page_keeps_every_article(to_text):
+    html = page("<article><h2>One</h2><p>First post</p></article><article><h2>Two</h2><p>Second post</p></article>")
+    assert to_text(html) == "One\n\nFirst post\n\nTwo\n\nSecond post"
+
+def test_dominant_article_is_the_content(to_text):
+    body = "Long body text. " * 20
+    html = page(f"<div>Share this</div><article><h1>Post</h1><p>{body}</p><article>Comment</article></article>")
+    assert to_text(html) == f"Post\n\n{body.strip()}\n\nComment"
+
+def test_markdown_to_text():
+    markdown = "# Title\n\nSome **bold** and [a link](http://x).\n\n```\ncode\n```\n\n- item"
+    assert markdown_to_text(markdown) == "Title\n\nSome bold and a link.\n\ncode\n\nitem"
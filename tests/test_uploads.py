@@ -0,0 +1,13 @@
+from mermaid_pdf import MIN_PAGES_FOR_POOL
+from mermaid_uploads import pdf_extraction_plan, pdf_memory_estimate
+
+MB = 1024 * 1024
+
+
+# Short documents are read in-process, so only one process's memory is reserved for them
+def test_short_pdf_reserves_one_process():
+    assert pdf_extraction_plan(MB, MIN_PAGES_FOR_POOL - 1, 8) == (1, pdf_memory_estimate(MB))
+
+def test_workers_are_capped_by_page_count():
+    assert pdf_extraction_plan(0, MIN_PAGES_FOR_POOL, 64)[0] == MIN_PAGES_FOR_POOL
+    assert pdf_extraction_plan(MB, 100, 2) == (2, 2 * pdf_memory_estimate(MB))